@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+
+"""
+Throughput and latency benchmark of the MQTT -> D-Bus path of MQTTtoGridMeter.py.
+
+A synthetic stream of paho MQTTMessages with the topic mix and rates of the HA meter bridge is fed
+through the real on_message handler, the CoalescingQueue and MeterService.update(). The D-Bus
+services are exported either on an in-memory stand-in for the bus connection (default) or on the
+local session bus (--bus session).
+
+Reported per run:
+    msgs_per_s          messages handled per second of CPU time spent in on_message and the drains
+    handler_p50_us/p99  latency of on_message (paho thread part)
+    drain_p50_us/p99    latency of one queue drain incl. the D-Bus update (main loop part)
+    signals_per_msg     D-Bus signals emitted per received message
+    alloc_bytes_per_msg memory allocated per message above the baseline (tracemalloc peak, separate pass)
+
+The publish policies run on real time. In a flood they hold back most values, so signals_per_msg of a
+flood is much lower than at realistic rates - use --paced to see that number for normal operation.
+
+The modbus scenario polls modbus_simulator.py on localhost through ModbusSource and reports
+    polls_per_s         polls per second of wall time, incl. the round trips to the simulator
+    poll_p50_us/p99     latency of one poll (all block reads and the decoding)
+    decode_us           decoding of one poll's registers alone
+    reads_per_poll      Modbus requests per poll
+
+The paths scenario adds and removes thousands of paths on one VeDbusService on the in-memory bus
+    add_us / delete_us  time per added / removed path
+    add_bulk_us         time per path added with one add_paths() call
+    getitems_us         one GetItems call with all paths present
+    getvalue_node_us    one GetValue on a tree node with a few items below it
+
+The wrap scenario sets values on a VeDbusItemExport without and with a pinned value type
+    set_generic_us      one value change with wrap_dbus_value
+    set_pinned_us       one value change with the float wrapper of a path added with valuetype=float
+    wrap_generic_ns / wrap_pinned_ns   the wrapping alone
+    dbus_types_generic / dbus_types_pinned   D-Bus types seen for values that alternate int and float
+
+The text scenario sets power values on a service with one path, and reads them back with GetItems
+    set_callback_us     one value change with a gettextcallback, like the meter paths had before
+    set_format_us       one value change with a textformat, memoized per value
+    set_lazy_us         one value change with a textformat on a service with lazytext=True
+    getitems_lazy_us    GetItems after each change of the lazy service, which formats the text then
+    alloc_bytes_per_set_callback / _format / _lazy   memory allocated per value change (tracemalloc)
+
+The recovery scenario compares leaving the degraded mode (no data for STALE_SECONDS) with a restart
+    degrade_us          invalidating the values of the grid meter
+    resume_us           the first update after data arrives again, until /Connected is 1
+    restart_ms          a new interpreter that imports the service and registers all its paths, what a
+                        restart by daemontools costs on top of its own delay (at least 1 s)
+
+Usage:
+    python benchmark.py mqtt                         # flood: messages as fast as possible
+    python benchmark.py mqtt --paced --duration 10   # realistic rates, in real time
+    python benchmark.py mqtt --input capture.bin     # messages recorded with MQTTtoGridMeter.py --capture
+    python benchmark.py --save baseline.json mqtt    # store the results
+    python benchmark.py --baseline baseline.json mqtt  # exit 1 if a result is worse than the tolerance
+    python benchmark.py modbus --map em24             # Modbus TCP source against the simulator
+    python benchmark.py paths --paths 5000            # add and remove paths of a VeDbusService
+    python benchmark.py wrap                          # value wrapping per set
+    python benchmark.py text                          # text formatting per set
+    python benchmark.py recovery                      # degraded mode vs. restart
+
+Needs dbus-python, PyGObject and paho-mqtt, like the service itself.
+"""
+
+import argparse
+import json
+import logging
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+
+import paho.mqtt.client as mqtt
+import dbus.bus
+from gi.repository import GLib
+
+import MQTTtoGridMeter as meter
+from vedbus import VeDbusItemExport, VeDbusService
+from ve_utils import dbus_value_wrapper, wrap_dbus_value
+from dbusmeter import capture
+from dbusmeter.engine import CoalescingQueue, DeviceRegistry
+from dbusmeter.sources.modbus import REGISTER_MAPS, ModbusSource
+from dbusmeter.sources.mqtt import MqttSource
+import modbus_simulator
+
+# topic suffix, rate in messages per second, value generator
+TOPIC_MIX = [
+    ('hausstrom_sum_active_instantaneous_power', 2.0, 'power'),
+    ('hausstrom_l1_active_instantaneous_power', 2.0, 'power'),
+    ('hausstrom_l2_active_instantaneous_power', 2.0, 'power'),
+    ('hausstrom_l3_active_instantaneous_power', 2.0, 'power'),
+    ('hausstrom_positive_active_energy_total', 0.1, 'energy_wh'),
+    ('solar_energy_to_grid', 0.1, 'energy_kwh'),
+    ('some_other_ha_sensor', 0.5, 'power'),  # not registered, dropped by on_message
+]
+
+# results that count the work done, not compared with the baseline
+COUNTS = ('messages', 'drains', 'polls', 'reads_per_poll', 'paths', 'sets', 'cycles')
+
+# results that get worse when they grow, all others get worse when they shrink
+LOWER_IS_BETTER = ('_us', '_ms', '_per_msg', '_callback', '_format', '_lazy')
+
+
+class MemoryBus:
+    ''' in-memory stand-in for a dbus BusConnection: object paths are accepted, signals are marshalled and counted '''
+
+    def __init__(self):
+        self._bus_names = weakref.WeakValueDictionary()
+        self.signals = 0
+
+    def request_name(self, name, flags=0):  # pylint: disable=unused-argument
+        return dbus.bus.REQUEST_NAME_REPLY_PRIMARY_OWNER
+
+    def release_name(self, name):
+        pass
+
+    def _register_object_path(self, path, on_message, on_unregister=None, fallback=False):
+        pass
+
+    def _unregister_object_path(self, path):
+        pass
+
+    def send_message(self, msg):  # pylint: disable=unused-argument
+        self.signals += 1
+
+
+class CountingSessionBus(dbus.bus.BusConnection):
+    ''' private session bus connection that counts the signals sent '''
+
+    def __new__(cls):
+        return dbus.bus.BusConnection.__new__(cls, dbus.bus.BusConnection.TYPE_SESSION)
+
+    def __init__(self):  # pylint: disable=super-init-not-called
+        self.signals = 0
+
+    def send_message(self, msg):
+        self.signals += 1
+        return dbus.bus.BusConnection.send_message(self, msg)
+
+
+def synthetic_stream(duration, rate_factor=1.0, seed=1):
+    ''' list of (time offset in s, MQTTMessage), sorted by time '''
+    rnd = random.Random(seed)
+    power = 500.0
+    energy_wh = 12345678.0
+    energy_kwh = 4321.0
+    stream = []
+    for suffix, rate, kind in TOPIC_MIX:
+        topic = f"{meter.Zaehlersensorpfad}/{suffix}".encode()
+        t = rnd.uniform(0, 1 / rate)
+        while t < duration:
+            if kind == 'power':
+                power += rnd.uniform(-20, 20)
+                value = power + rnd.uniform(-1, 1)  # +-1 W jitter
+            elif kind == 'energy_wh':
+                energy_wh += rnd.uniform(0, 50)
+                value = energy_wh
+            else:
+                energy_kwh += rnd.uniform(0, 0.05)
+                value = energy_kwh
+            msg = mqtt.MQTTMessage(topic=topic)
+            msg.payload = f"{value:.3f}".encode()
+            stream.append((t, msg))
+            t += rnd.expovariate(rate * rate_factor)
+    stream.sort(key=lambda x: x[0])
+    return stream
+
+
+def capture_stream(path):
+    ''' list of (time offset in s, MQTTMessage) from a file recorded with MQTTtoGridMeter.py --capture '''
+    reader = capture.CaptureReader(path)
+    stream = []
+    first = None
+    for timestamp, topic, payload in reader:
+        if first is None:
+            first = timestamp
+        msg = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+        msg.payload = payload
+        stream.append((timestamp - first, msg))
+    reader.close()
+    return stream
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_stream(stream, on_message, update_queue, paced=False, coalesce_ms=meter.COALESCE_MS,
+               measure_alloc=False):
+    ''' feed the stream through on_message and the queue, returns the measurements '''
+    context = GLib.MainContext.default()
+    window = (coalesce_ms or 0) / 1000
+
+    handler_times = []
+    drain_times = []
+    alloc_bytes = 0
+
+    def _drain():
+        nonlocal alloc_bytes
+        if measure_alloc:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        update_queue.drain()
+        drain_times.append(time.perf_counter() - t0)
+        if measure_alloc:
+            alloc_bytes += tracemalloc.get_traced_memory()[1] - base
+        while context.pending():  # due GLib timers, e.g. values held back by a publish policy
+            context.iteration(False)
+
+    # the queue is drained once per coalesce window of stream time, like the GLib timer does in real time
+    start = time.perf_counter()
+    next_drain = window
+    for offset, msg in stream:
+        if paced:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        if measure_alloc:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        on_message(None, update_queue, msg)
+        handler_times.append(time.perf_counter() - t0)
+        if measure_alloc:
+            alloc_bytes += tracemalloc.get_traced_memory()[1] - base
+
+        if offset >= next_drain:
+            _drain()
+            next_drain = offset + window
+    _drain()
+
+    return handler_times, drain_times, alloc_bytes
+
+
+def bench_mqtt(args):
+    stream = capture_stream(args.input) if args.input else synthetic_stream(args.duration, args.rate_factor)
+    messages = len(stream)
+
+    buses = []
+
+    def _bus():
+        bus = CountingSessionBus() if args.bus == 'session' else MemoryBus()
+        buses.append(bus)
+        return bus
+
+    source = MqttSource(meter.TOPICS)
+    devices = DeviceRegistry(meter.DEVICES, source.channels(), bus_factory=_bus)
+    update_queue = CoalescingQueue(devices.update, coalesce_ms=None)  # drained by run_stream
+
+    handler_times, drain_times, _ = run_stream(stream, source.on_message, update_queue, paced=args.paced)
+    signals = sum(bus.signals for bus in buses)
+
+    # allocations are measured in a second pass, tracemalloc distorts the timing
+    tracemalloc.start()
+    _, _, alloc_bytes = run_stream(stream, source.on_message, update_queue, measure_alloc=True)
+    tracemalloc.stop()
+
+    busy = sum(handler_times) + sum(drain_times)
+    return {
+        'messages': messages,
+        'drains': len(drain_times),
+        'msgs_per_s': round(messages / busy) if busy else 0,
+        'handler_p50_us': round(percentile(handler_times, 50) * 1e6, 1),
+        'handler_p99_us': round(percentile(handler_times, 99) * 1e6, 1),
+        'drain_p50_us': round(percentile(drain_times, 50) * 1e6, 1),
+        'drain_p99_us': round(percentile(drain_times, 99) * 1e6, 1),
+        'signals_per_msg': round(signals / messages, 3),
+        'alloc_bytes_per_msg': round(alloc_bytes / messages),
+    }
+
+
+def bench_modbus(args):
+    server = modbus_simulator.make_server(args.map, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    source = ModbusSource(host, port, registermap=args.map)
+    blocks = source._blocks  # pylint: disable=protected-access
+    try:
+        source.poll()  # connect
+        poll_times = []
+        start = time.perf_counter()
+        for _ in range(args.polls):
+            t0 = time.perf_counter()
+            source.poll()
+            poll_times.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+
+        # decoding alone, on registers read once
+        registers = [bytes(source._client.read_registers(  # pylint: disable=protected-access
+            REGISTER_MAPS[args.map]['function'], block.address, block.count)) for block in blocks]
+        t0 = time.perf_counter()
+        for _ in range(args.polls):
+            values = {}
+            for block, data in zip(blocks, registers):
+                block.decode(data, values)
+        decode_time = (time.perf_counter() - t0) / args.polls
+    finally:
+        source.close()
+        server.shutdown()
+
+    return {
+        'polls': args.polls,
+        'polls_per_s': round(args.polls / elapsed),
+        'poll_p50_us': round(percentile(poll_times, 50) * 1e6, 1),
+        'poll_p99_us': round(percentile(poll_times, 99) * 1e6, 1),
+        'decode_us': round(decode_time * 1e6, 2),
+        'reads_per_poll': len(blocks),
+    }
+
+
+def bench_paths(args):
+    # per device: the meter paths of three phases, like a service with many sub-meters
+    paths = [f'/Device/{device}/Ac/L{phase}/{name}'
+             for device in range(args.paths // 15 + 1)
+             for phase in range(1, 4)
+             for name in ('Power', 'Voltage', 'Current', 'Energy/Forward', 'Energy/Reverse')][:args.paths]
+    service = VeDbusService('com.victronenergy.grid.benchmark', bus=MemoryBus())
+
+    t0 = time.perf_counter()
+    for path in paths:
+        service.add_path(path, 0.0)
+    added = time.perf_counter() - t0
+
+    root = service._dbusnodes['/']  # pylint: disable=protected-access
+    node = service._dbusnodes['/Device/0/Ac/L1']  # pylint: disable=protected-access
+    t0 = time.perf_counter()
+    root.GetItems()
+    getitems = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        node.GetValue()
+    getvalue = (time.perf_counter() - t0) / 1000
+
+    t0 = time.perf_counter()
+    for path in paths:
+        del service[path]
+    deleted = time.perf_counter() - t0
+
+    service = VeDbusService('com.victronenergy.grid.benchmark_bulk', bus=MemoryBus())
+    t0 = time.perf_counter()
+    service.add_paths({path: {'value': 0.0} for path in paths})
+    added_bulk = time.perf_counter() - t0
+
+    return {
+        'paths': len(paths),
+        'add_us': round(added / len(paths) * 1e6, 1),
+        'add_bulk_us': round(added_bulk / len(paths) * 1e6, 1),
+        'delete_us': round(deleted / len(paths) * 1e6, 1),
+        'getitems_us': round(getitems * 1e6, 1),
+        'getvalue_node_us': round(getvalue * 1e6, 1),
+    }
+
+
+def bench_wrap(args):
+    # power / 230 rounded: mostly floats, now and then an int
+    values = [round(random.uniform(-5000, 5000) / 230, 2) if i % 10 else i for i in range(args.sets)]
+    bus = MemoryBus()
+    results = {}
+    for name, valuetype, wrap in (('generic', None, wrap_dbus_value), ('pinned', float, dbus_value_wrapper(float))):
+        item = VeDbusItemExport(bus, f'/Ac/{name}', None, valuetype=valuetype)
+        t0 = time.perf_counter()
+        for value in values:
+            item._local_set_value(value)  # pylint: disable=protected-access
+        results[f'set_{name}_us'] = round((time.perf_counter() - t0) / len(values) * 1e6, 3)
+
+        converted = [float(v) for v in values] if valuetype else values  # the item converts before wrapping
+        t0 = time.perf_counter()
+        for value in converted:
+            wrap(value)
+        results[f'wrap_{name}_ns'] = round((time.perf_counter() - t0) / len(values) * 1e9)
+
+        types = set()
+        for value in values:
+            changes = item._local_set_value(value)  # pylint: disable=protected-access
+            if changes is not None:
+                types.add(type(changes['Value']).__name__)
+        results[f'dbus_types_{name}'] = len(types)
+    results['sets'] = len(values)
+    return results
+
+
+def bench_text(args):
+    # power values with a 1 W resolution that move around a few set points, as a deadband would leave them
+    values = [float(round(random.gauss(random.choice((-1500, 300, 2500)), 3))) for _ in range(args.sets)]
+    results = {}
+    for name, options, lazytext in (
+            ('callback', {'gettextcallback': lambda p, v: str(int(round(v, 0))) + 'W'}, False),
+            ('format', {'textformat': '{:.0f}W'}, False),
+            ('lazy', {'textformat': '{:.0f}W'}, True)):
+        service = VeDbusService(f'com.victronenergy.grid.{name}', bus=MemoryBus(), lazytext=lazytext)
+        service.add_path('/Ac/Power', None, valuetype=float, **options)
+        item = service._dbusobjects['/Ac/Power']  # pylint: disable=protected-access
+        root = service._dbusnodes['/']  # pylint: disable=protected-access
+
+        t0 = time.perf_counter()
+        for value in values:
+            item._local_set_value(value)  # pylint: disable=protected-access
+        results[f'set_{name}_us'] = round((time.perf_counter() - t0) / len(values) * 1e6, 3)
+
+        tracemalloc.start()
+        alloc_bytes = 0
+        for value in values:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            item._local_set_value(-value)  # pylint: disable=protected-access
+            alloc_bytes += tracemalloc.get_traced_memory()[1] - base
+        results[f'alloc_bytes_per_set_{name}'] = round(alloc_bytes / len(values), 1)
+        tracemalloc.stop()
+
+        if lazytext:
+            t0 = time.perf_counter()
+            for value in values:
+                item._local_set_value(value)  # pylint: disable=protected-access
+                root.GetItems()
+            set_and_get = (time.perf_counter() - t0) / len(values)
+            results['getitems_lazy_us'] = round(set_and_get * 1e6 - results['set_lazy_us'], 3)
+    results['sets'] = len(values)
+    return results
+
+
+# a restart: interpreter start, imports and registering the services, with the in-memory bus
+RESTART_SCRIPT = '''
+import MQTTtoGridMeter as meter
+from benchmark import MemoryBus
+from dbusmeter.engine import DeviceRegistry
+from dbusmeter.sources.mqtt import MqttSource
+DeviceRegistry(meter.DEVICES, MqttSource(meter.TOPICS).channels(), bus_factory=MemoryBus)
+'''
+
+
+def bench_recovery(args):
+    source = MqttSource(meter.TOPICS)
+    devices = DeviceRegistry(meter.DEVICES, source.channels(), bus_factory=MemoryBus)
+    channels = [key for key in source.channels() if key[0] == 'grid']
+    service = devices['grid']
+    vedbusservice = service._vedbusservice  # pylint: disable=protected-access
+
+    degrade_times = []
+    resume_times = []
+    logging.disable(logging.WARNING)  # one warning per degrade
+    for i in range(args.cycles):
+        pending = {key: (float(1000 + i), time.monotonic()) for key in channels}
+        devices.update(pending)
+        t0 = time.perf_counter()
+        service._degrade(invalidate=True)  # pylint: disable=protected-access
+        degrade_times.append(time.perf_counter() - t0)
+        assert vedbusservice['/Connected'] == 0
+
+        pending = {key: (float(2000 + i), time.monotonic()) for key in channels}
+        t0 = time.perf_counter()
+        devices.update(pending)
+        resume_times.append(time.perf_counter() - t0)
+        assert vedbusservice['/Connected'] == 1
+    logging.disable(logging.NOTSET)
+
+    restart_times = []
+    for _ in range(args.restarts):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', RESTART_SCRIPT], check=True)
+        restart_times.append(time.perf_counter() - t0)
+
+    return {
+        'cycles': args.cycles,
+        'degrade_us': round(percentile(degrade_times, 50) * 1e6, 1),
+        'resume_us': round(percentile(resume_times, 50) * 1e6, 1),
+        'restart_ms': round(min(restart_times) * 1000, 1),
+    }
+
+
+def compare(name, results, baseline, tolerance):
+    ''' returns the list of regressions of results against the baseline '''
+    regressions = []
+    for key, base in baseline.get(name, {}).items():
+        value = results.get(key)
+        if value is None or key in COUNTS or not base:
+            continue
+        change = (value - base) / abs(base)
+        worse = change > tolerance if key.endswith(LOWER_IS_BETTER) else change < -tolerance
+        if worse:
+            regressions.append(f"{name}.{key}: {value} (baseline {base}, {change:+.0%})")
+    return regressions
+
+
+SCENARIOS = {
+    'mqtt': bench_mqtt,
+    'modbus': bench_modbus,
+    'paths': bench_paths,
+    'wrap': bench_wrap,
+    'text': bench_text,
+    'recovery': bench_recovery,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', metavar='FILE', help='store the results as baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results with a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression (default 0.2)')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    mqtt_parser = subparsers.add_parser('mqtt', help='MQTT message -> D-Bus update')
+    mqtt_parser.add_argument('--duration', type=float, default=600, help='seconds of synthetic input (default 600)')
+    mqtt_parser.add_argument('--rate-factor', type=float, default=1.0, help='multiply the topic rates')
+    mqtt_parser.add_argument('--paced', action='store_true', help='replay in real time instead of as fast as possible')
+    mqtt_parser.add_argument('--bus', choices=('memory', 'session'), default='memory')
+    mqtt_parser.add_argument('--input', metavar='FILE', help='use a capture file instead of the synthetic stream')
+
+    modbus_parser = subparsers.add_parser('modbus', help='Modbus TCP poll of the simulated meter')
+    modbus_parser.add_argument('--map', choices=sorted(REGISTER_MAPS), default='sdm630', help='register map')
+    modbus_parser.add_argument('--polls', type=int, default=2000, help='number of polls (default 2000)')
+
+    paths_parser = subparsers.add_parser('paths', help='add and remove D-Bus paths')
+    paths_parser.add_argument('--paths', type=int, default=5000, help='number of paths (default 5000)')
+
+    wrap_parser = subparsers.add_parser('wrap', help='value wrapping of an exported path')
+    wrap_parser.add_argument('--sets', type=int, default=100000, help='number of value changes (default 100000)')
+
+    text_parser = subparsers.add_parser('text', help='text formatting of an exported path')
+    text_parser.add_argument('--sets', type=int, default=100000, help='number of value changes (default 100000)')
+
+    recovery_parser = subparsers.add_parser('recovery', help='degraded mode and recovery vs. restart')
+    recovery_parser.add_argument('--cycles', type=int, default=1000, help='degrade/resume cycles (default 1000)')
+    recovery_parser.add_argument('--restarts', type=int, default=3, help='restarts timed, the fastest counts')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = SCENARIOS[args.scenario](args)
+    print(json.dumps({args.scenario: results}, indent=2))
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(args.scenario, results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        status = 1 if regressions else 0
+
+    if args.save:
+        try:
+            with open(args.save, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {}
+        saved[args.scenario] = results
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(saved, f, indent=2)
+
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Reads a meter over Modbus TCP (SDM630, EM24 register maps) and publishes it on D-Bus as a Victron grid meter.
+Register maps: dbusmeter/sources/modbus.py, simulated meter for testing: modbus_simulator.py
+"""
+
+import argparse
+import os
+import sys
+import logging
+
+# our own packages
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../ext/velib_python'))
+from dbusmeter.engine import (  # pylint: disable=wrong-import-position
+    CoalescingQueue, DeviceRegistry, run_mainloop, startup_timer)
+from dbusmeter.logsetup import init_logging  # pylint: disable=wrong-import-position
+from dbusmeter.sources import MAX_INTERVAL, MIN_INTERVAL, PollScheduler  # pylint: disable=wrong-import-position
+from dbusmeter.sources.modbus import REGISTER_MAPS, ModbusSource  # pylint: disable=wrong-import-position
+
+# Modbus TCP Setup
+MODBUS_HOST = "192.168.40.230"
+MODBUS_PORT = 502
+MODBUS_UNIT = 1
+REGISTER_MAP = 'sdm630'
+
+# see DEVICES in MQTTtoGridMeter.py
+DEVICES = {
+    'grid': {
+        'servicename': 'com.victronenergy.grid.modbus_meter',
+        'deviceclass': 'grid',
+        'deviceinstance': 33,
+        'productname': 'Modbus Meter',
+        'connection': 'Modbus TCP',
+    },
+}
+
+# see SNAPSHOT_DIR in MQTTtoGridMeter.py
+SNAPSHOT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+LOG_LEVEL = logging.INFO
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Publishes the values of a Modbus TCP meter on D-Bus.')
+    parser.add_argument('--host', default=MODBUS_HOST)
+    parser.add_argument('--port', type=int, default=MODBUS_PORT)
+    parser.add_argument('--unit', type=int, default=MODBUS_UNIT, help='Modbus unit id')
+    parser.add_argument('--map', choices=sorted(REGISTER_MAPS), default=REGISTER_MAP, help='register map')
+    parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL, help='shortest poll interval in seconds')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL, help='longest poll interval in seconds')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    startup_timer.mark('import')
+    init_logging(LOG_LEVEL, ident='modbus-meter', defer=True)
+
+    from dbus.mainloop.glib import DBusGMainLoop
+    # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
+    DBusGMainLoop(set_as_default=True)
+
+    source = ModbusSource(args.host, args.port, args.unit, args.map,
+                          scheduler=PollScheduler(args.min_interval, args.max_interval))
+    devices = DeviceRegistry(DEVICES, source.channels(), on_stale=source.stale, snapshot_dir=SNAPSHOT_DIR)
+    source.start(CoalescingQueue(devices.update))
+    startup_timer.mark('source start')
+
+    logging.debug('Switching over to gobject.MainLoop() (= event based)')
+    run_mainloop()  # until SIGTERM, then the snapshots are saved on exit
+
+
+if __name__ == "__main__":
+    main()
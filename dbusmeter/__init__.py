@@ -0,0 +1,10 @@
+'''
+Publishes meter readings on D-Bus as Venus OS devices (grid meter, AC load, PV inverter).
+
+The readings come from a source (see dbusmeter.sources) and go through the publishing engine
+(see dbusmeter.engine), which is the same for all sources.
+
+Nothing is imported here: only dbusmeter.engine, dbusmeter.logsetup and the MQTT source need dbus-python and
+PyGObject, the other modules (derive, integrator, snapshot, capture, the Modbus source) can be used and tested
+without them.
+'''
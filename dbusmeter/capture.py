@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Record and replay of received MQTT messages.
+
+A capture file starts with a header holding the topic dictionary, followed by fixed size records:
+
+    header: b'MQTC', version (uint16), number of topics (uint16),
+            per topic: length (uint16) and the topic as utf-8, the topic id is its index
+    record: timestamp (float64, time.time()), topic id (uint16), payload length (uint8), payload (21 bytes)
+
+All numbers are little endian, a record has 32 bytes. Longer payloads are cut to 21 bytes, that is
+more than any numeric sensor value needs.
+"""
+
+import logging
+import mmap
+import struct
+import threading
+import time
+
+MAGIC = b'MQTC'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+TOPIC_LENGTH = struct.Struct('<H')
+RECORD = struct.Struct('<dHB21s')
+PAYLOAD_SIZE = 21
+
+CAPTURE_BUFFER = 64 * 1024  # bytes collected before the capture file is written
+
+
+class CaptureWriter:
+    '''
+    Appends the messages of the registered topics to a capture file, called from the paho thread.
+    flush_seconds: a thread of the writer flushes the file at this interval, so the main loop never writes it
+    '''
+
+    def __init__(self, path, topics, flush_seconds=None):
+        self._ids = {topic: i for i, topic in enumerate(topics)}
+        self._truncated = False
+        self._lock = threading.Lock()  # flush and close
+        self._closed = threading.Event()
+        self._file = open(path, 'wb', buffering=CAPTURE_BUFFER)  # pylint: disable=consider-using-with
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(topics)))
+        for topic in topics:
+            encoded = topic.encode('utf-8')
+            self._file.write(TOPIC_LENGTH.pack(len(encoded)) + encoded)
+        logging.info(f"capturing {len(topics)} MQTT topics to {path}")
+        if flush_seconds is not None:
+            threading.Thread(target=self._flush_periodically, args=(flush_seconds,), name='capture-flush',
+                             daemon=True).start()
+
+    def write(self, timestamp, topic, payload):
+        topic_id = self._ids.get(topic)
+        if topic_id is None:
+            return
+        if len(payload) > PAYLOAD_SIZE and not self._truncated:
+            logging.warning(f"capture: payload of {topic} cut to {PAYLOAD_SIZE} bytes")
+            self._truncated = True
+        payload = payload[:PAYLOAD_SIZE]
+        self._file.write(RECORD.pack(timestamp, topic_id, len(payload), payload))
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def _flush_periodically(self, seconds):
+        while not self._closed.wait(seconds):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._file.close()
+
+
+class CaptureReader:
+    ''' memory-maps a capture file, iterating yields (timestamp, topic, payload) '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is no capture file of version {VERSION}")
+
+        offset = HEADER.size
+        self.topics = []
+        for _ in range(count):
+            length, = TOPIC_LENGTH.unpack_from(self._map, offset)
+            offset += TOPIC_LENGTH.size
+            self.topics.append(self._map[offset:offset + length].decode('utf-8'))
+            offset += length
+
+        # a record cut off by a crash while capturing is ignored
+        self._offset = offset
+        self._end = offset + (len(self._map) - offset) // RECORD.size * RECORD.size
+
+    def __len__(self):
+        return (self._end - self._offset) // RECORD.size
+
+    def __iter__(self):
+        topics = self.topics
+        with memoryview(self._map) as view, view[self._offset:self._end] as records:
+            for timestamp, topic_id, length, payload in RECORD.iter_unpack(records):
+                yield timestamp, topics[topic_id], payload[:length]
+
+    def close(self):
+        self._map.close()
+
+
+def capturing(writer, on_message):
+    ''' returns a paho on_message callback that captures each message before on_message handles it '''
+    def on_message_captured(client, userdata, msg):
+        writer.write(time.time(), msg.topic, msg.payload)
+        on_message(client, userdata, msg)
+    return on_message_captured
+
+
+def replay(path, on_message, userdata, speed=1.0):
+    '''
+    Feeds a capture file through on_message, like the paho thread does. speed: 1 = real time, N = N times faster,
+    0 = as fast as possible. Runs in a background thread, which is returned.
+    '''
+    import paho.mqtt.client as mqtt  # pylint: disable=import-outside-toplevel
+
+    def _run():
+        reader = CaptureReader(path)
+        logging.info(f"replaying {len(reader)} MQTT messages from {path} at speed {speed or 'max'}")
+        start = time.monotonic()
+        first = None
+        for timestamp, topic, payload in reader:
+            if first is None:
+                first = timestamp
+            if speed:
+                delay = start + (timestamp - first) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            msg = mqtt.MQTTMessage(topic=topic.encode('utf-8'))
+            msg.payload = payload
+            on_message(None, userdata, msg)
+        reader.close()
+        logging.info(f"replay of {path} finished")
+
+    thread = threading.Thread(target=_run, name='replay', daemon=True)
+    thread.start()
+    return thread
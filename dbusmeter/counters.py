@@ -0,0 +1,14 @@
+'''
+Process wide message counters, shared by the sources and the engine without pulling in dbus or GLib.
+'''
+
+
+class MessageCounters:
+    ''' process wide counters of the readings of all sources '''
+
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0  # unknown topic, invalid payload or replaced in the queue before it was handled
+
+
+message_counters = MessageCounters()
@@ -0,0 +1,132 @@
+'''
+Derived D-Bus paths: the values a meter does not send, computed from the ones it does.
+
+DERIVATIONS lists for each derivable path its alternatives, each a dict with
+
+    'inputs':   the paths it is computed from
+    'function': called with the values of the inputs, in that order
+    'partial':  True: uses whichever inputs are there, at least one, e.g. the sum of the phases of a single-phase
+                meter. Only considered when no other path can be resolved any more.
+    'unless':   not used if the source sends one of these paths
+
+When a service starts, the alternatives are compiled against the paths it gets from its source: a path that is
+measured is never derived, otherwise the first alternative whose inputs are all measured or derived themselves is
+used. Paths with none are left alone. After that, each update only recomputes the paths whose inputs changed, and
+only a result that differs from the last one is published.
+'''
+
+NOMINAL_VOLTAGE = 230  # published for phases without a measured voltage
+
+
+def _nominal_voltage():
+    return NOMINAL_VOLTAGE
+
+
+def _current(power, voltage):
+    return round(power / voltage, 2) if voltage else None
+
+
+def _third(total):
+    # Add L123/Energy/Forward/Reverse hoping this helps to show correct Consumption values in VRM
+    return round(total / 3, 2)
+
+
+def _sum(*values):
+    return round(sum(values), 2)
+
+
+def _phases(path):
+    ''' '/Ac/Lx/Power' -> the paths of the three phases '''
+    return tuple(path.replace('Lx', f'L{i}') for i in range(1, 4))
+
+
+# see https://github.com/victronenergy/venus/wiki/dbus#grid-and-genset-meter
+DERIVATIONS = {
+    '/Ac/Power': [{'inputs': _phases('/Ac/Lx/Power'), 'function': _sum, 'partial': True}],
+    '/Ac/Energy/Forward': [{'inputs': _phases('/Ac/Lx/Energy/Forward'), 'function': _sum, 'partial': True}],
+    '/Ac/Energy/Reverse': [{'inputs': _phases('/Ac/Lx/Energy/Reverse'), 'function': _sum, 'partial': True}],
+}
+for _i in range(1, 4):
+    DERIVATIONS.update({
+        f'/Ac/L{_i}/Voltage': [{'inputs': (), 'function': _nominal_voltage}],
+        f'/Ac/L{_i}/Current': [{'inputs': (f'/Ac/L{_i}/Power', f'/Ac/L{_i}/Voltage'), 'function': _current}],
+        # only a meter without any phase power splits its total, otherwise the phases have their own energy
+        f'/Ac/L{_i}/Energy/Forward': [
+            {'inputs': ('/Ac/Energy/Forward',), 'function': _third, 'unless': _phases('/Ac/Lx/Power')}],
+        f'/Ac/L{_i}/Energy/Reverse': [
+            {'inputs': ('/Ac/Energy/Reverse',), 'function': _third, 'unless': _phases('/Ac/Lx/Power')}],
+    })
+
+
+class Derivations:
+    '''
+    The derived paths of one service.
+
+    paths:   the D-Bus paths the service exports
+    sources: the paths whose values come from elsewhere, the source channels and the integrated energy counters
+    '''
+
+    def __init__(self, paths, sources, derivations=DERIVATIONS):
+        self._rules = []  # (path, inputs, function), in the order they are computed
+        self.inputs = {}  # derived path -> the paths it is computed from
+        sources = set(sources)
+        available = set(sources)
+        pending = {
+            path: [alternative for alternative in alternatives if sources.isdisjoint(alternative.get('unless', ()))]
+            for path, alternatives in derivations.items() if path in paths and path not in sources}
+        partial = False
+        while pending:
+            # a path may need another derived path, e.g. the current the nominal voltage
+            resolved = {}
+            for path, alternatives in pending.items():
+                for alternative in alternatives:
+                    inputs = alternative['inputs']
+                    if partial and alternative.get('partial'):
+                        inputs = tuple(source for source in inputs if source in available)
+                        if not inputs:
+                            continue
+                    if all(source in available for source in inputs):
+                        resolved[path] = (inputs, alternative['function'])
+                        break
+            if not resolved:
+                if partial:
+                    break
+                partial = True  # all complete alternatives are resolved, now take the phases that are there
+                continue
+            partial = False
+            for path, (inputs, function) in resolved.items():
+                self._rules.append((path, inputs, function))
+                self.inputs[path] = inputs
+                available.add(path)
+                del pending[path]
+
+        self._values = {}  # latest value of each input and derived path
+        self._outputs = {}  # derived path -> value last returned
+        self._all = True  # compute every path in the next update, e.g. the constants
+
+    def update(self, values):
+        ''' values: dict path -> new value. Returns a dict of the derived paths that changed. '''
+        self._values.update(values)
+        changed = set(values)
+        derived = {}
+        for path, inputs, function in self._rules:
+            if not self._all and changed.isdisjoint(inputs):
+                continue
+            args = [self._values.get(source) for source in inputs]
+            value = None if None in args else function(*args)
+            if value != self._outputs.get(path):
+                derived[path] = self._outputs[path] = self._values[path] = value
+                changed.add(path)
+        self._all = False
+        return derived
+
+    def restore(self, values):
+        ''' values that are on D-Bus already, e.g. from the snapshot, count as inputs and as published '''
+        self._values.update(values)
+        self._outputs.update((path, value) for path, value in values.items() if path in self.inputs)
+
+    def reset(self):
+        ''' all values were invalidated: forget them, the next update computes every path again '''
+        self._values.clear()
+        self._outputs.clear()
+        self._all = True
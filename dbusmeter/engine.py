@@ -0,0 +1,652 @@
+'''
+The publishing engine: readings of any source go through the CoalescingQueue into the MeterService of their
+device, which applies the publish policies, derives missing values, publishes each batch as one ItemsChanged
+signal and keeps the statistics under /Mgmt/Stats.
+'''
+
+import atexit
+import bisect
+import logging
+import os
+import platform
+import re
+import signal
+import sys
+import threading
+import time
+
+from dbus.bus import BusConnection
+from gi.repository import GLib as gobject
+from vedbus import VeDbusService
+
+from dbusmeter.counters import message_counters
+from dbusmeter.derive import Derivations
+from dbusmeter.integrator import EnergyIntegrator
+from dbusmeter.paths import DEVICE_CLASSES, _ms, _per_s, _s
+from dbusmeter.snapshot import SNAPSHOT_INTERVAL, Snapshot
+from dbusmeter.startup import startup_timer
+
+path_UpdateIndex = '/UpdateIndex'
+
+# readings arriving within this many ms are merged into one D-Bus update
+COALESCE_MS = 50
+
+LOG_VALUE_INTERVAL = 10  # seconds between two debug lines for the same value
+
+# After STALE_SECONDS without an update a grid meter invalidates its values and sets /Connected to 0 until data
+# arrives again. The source is asked to reconnect right away, then after SOURCE_RETRY_MIN seconds, doubling up
+# to SOURCE_RETRY_MAX while the data stays away.
+STALE_SECONDS = 10
+SOURCE_RETRY_MIN = 10
+SOURCE_RETRY_MAX = 300
+
+# Statistics under /Mgmt/Stats are published every STATS_INTERVAL seconds
+STATS_INTERVAL = 10
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # upper bounds, plus one for more
+
+
+class CoalescingQueue:
+    '''
+    Thread-safe handoff from the source threads to the GLib main loop.
+
+    put() may be called from any thread. The values are collected by key - a newer value replaces an older one
+    that has not been handled yet - and the whole batch is passed to the consumer on the main loop, once per
+    coalesce_ms window. With coalesce_ms=None nothing is scheduled and the owner calls drain() itself.
+    A value that is replaced before it was handled counts as a dropped message.
+    '''
+
+    def __init__(self, consumer, coalesce_ms=COALESCE_MS):
+        self._consumer = consumer
+        self._coalesce_ms = coalesce_ms
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._scheduled = False
+
+    def put(self, key, value):
+        self.put_many(((key, value),))
+
+    def put_many(self, items):
+        ''' items: iterable of (key, value), e.g. all values of one reading, handed over under one lock '''
+        with self._lock:
+            for key, value in items:
+                if key in self._pending:
+                    message_counters.dropped += 1
+                self._pending[key] = value
+            if self._scheduled:
+                return
+            self._scheduled = True
+
+        # GLib sources may be added from any thread, the callback always runs on the main loop
+        if self._coalesce_ms is None:
+            return
+        if self._coalesce_ms > 0:
+            gobject.timeout_add(self._coalesce_ms, self.drain)
+        else:
+            gobject.idle_add(self.drain)
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+
+        if pending:
+            try:
+                self._consumer(pending)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.exception("dbusmeter crashed during update", exc_info=e)
+        return False  # one-shot source, put() schedules the next one
+
+
+class LatencyHistogram:
+    '''
+    Fixed-bucket histogram of latencies in ms, constant memory.
+
+    Percentiles and the maximum are taken from the values added since the last call of take_window(), the
+    bucket counts are kept since start.
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self._bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self._window = [0] * (len(buckets) + 1)
+        self._window_max = 0.0
+
+    def add(self, latency_ms):
+        i = bisect.bisect_left(self._bounds, latency_ms)
+        self.counts[i] += 1
+        self._window[i] += 1
+        if latency_ms > self._window_max:
+            self._window_max = latency_ms
+
+    def take_window(self):
+        ''' returns (p50, p99, max) of the window in ms (None if it is empty) and starts a new window '''
+        window, self._window = self._window, [0] * len(self._window)
+        window_max, self._window_max = self._window_max, 0.0
+        total = sum(window)
+        if total == 0:
+            return None, None, None
+        window_max = round(window_max, 1)
+        return (self._percentile(window, total, 0.5, window_max),
+                self._percentile(window, total, 0.99, window_max),
+                window_max)
+
+    def _percentile(self, window, total, p, window_max):
+        ''' upper bound of the bucket the percentile falls in, but never more than the maximum '''
+        rank = p * total
+        seen = 0
+        for bound, count in zip(self._bounds, window):
+            seen += count
+            if seen >= rank:
+                return min(float(bound), window_max)
+        return window_max  # in the last bucket, which has no upper bound
+
+
+class PublishPolicy:
+    '''
+    Decides for one D-Bus path whether a new value is published.
+
+    deadband:    publish only if the value moved by more than this from the last published value
+    reldeadband: ... or by more than this fraction of the last published value, the larger one counts
+    mininterval: seconds between two publishes. A newer value is held back and published afterwards.
+    maxinterval: publish the latest value after this many seconds even if it is within the deadband
+    '''
+
+    def __init__(self, deadband=0, reldeadband=0, mininterval=0, maxinterval=None):
+        self._deadband = deadband
+        self._reldeadband = reldeadband
+        self._mininterval = mininterval
+        self._maxinterval = maxinterval
+        self._published = None
+        self._published_at = None
+        self.held = None  # latest value that was not published
+        self.held_until = None  # when the held value is due: after mininterval, or after maxinterval as heartbeat
+
+    def offer(self, value, now):
+        ''' returns True if value is to be published now, otherwise it is held '''
+        self.held = None
+        self.held_until = None
+        if value is None or self._published is None:
+            return self._publish(value, now)
+
+        since = now - self._published_at
+        if self._maxinterval is not None and since >= self._maxinterval:
+            return self._publish(value, now)
+
+        if abs(value - self._published) <= max(self._deadband, self._reldeadband * abs(self._published)):
+            self.held = value
+            if self._maxinterval is not None:
+                self.held_until = self._published_at + self._maxinterval
+            return False
+
+        if since < self._mininterval:
+            self.held = value
+            self.held_until = self._published_at + self._mininterval
+            return False
+
+        return self._publish(value, now)
+
+    def reset(self):
+        ''' forget the published and the held value, the next value is published right away '''
+        self._published = None
+        self._published_at = None
+        self.held = None
+        self.held_until = None
+
+    def _publish(self, value, now):
+        self._published = value
+        self._published_at = now
+        return True
+
+
+def log_value(value, label, unit=''):
+    ''' debug output of a value, at most once per LOG_VALUE_INTERVAL for each label '''
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
+    now = time.monotonic()
+    last = log_value.last_logged.get(label)
+    if last is not None and now - last < LOG_VALUE_INTERVAL:
+        return
+    log_value.last_logged[label] = now
+    logging.debug("%s: %.0f %s", label, value, unit)
+
+
+log_value.last_logged = {}
+
+
+class MeterService:
+    '''
+    One meter device on D-Bus.
+
+    channels: dict D-Bus path -> name of the source channel (MQTT topic, JSON key, ...) feeding it. The latency
+              statistics are published per channel, paths without a channel are derived from the others, see
+              dbusmeter.derive
+    on_stale: called without arguments when no update came for STALE_SECONDS, with a backoff while that lasts,
+              e.g. Source.stale() to reconnect
+    snapshot: file name of the snapshot of the paths with 'persist', restored at startup, see dbusmeter.snapshot
+    '''
+
+    def __init__(self, servicename, deviceinstance, paths, productname, connection,
+                 role='grid', productid=45069, devicetype=345, position=0, bus=None, channels=None,
+                 itemsignals=False, lazytext=False, on_stale=None, snapshot=None):
+        self._vedbusservice = VeDbusService(servicename, bus=bus, itemsignals=itemsignals, lazytext=lazytext)
+        self._paths = paths
+        self._role = role
+        self._policies = {
+            path: PublishPolicy(**settings['policy']) for path, settings in paths.items() if 'policy' in settings}
+        self._held_timer = None
+        self._held_due = None  # time.monotonic() the held timer is scheduled for
+        self._received = {}  # path -> time the latest value was received, for the latency statistics
+        self._on_stale = on_stale
+        self._degraded_since = None  # time.monotonic() when the data went stale
+        self._stale_retry_at = 0
+        self._stale_retry_delay = SOURCE_RETRY_MIN
+
+        channels = channels or {}
+        # phases with a measured power but without own energy counters: integrate the power, see dbusmeter.integrator
+        unmeasured = {path for path in paths if path not in channels}
+        integrated = [
+            (f'/Ac/L{i}/Power', *(path if path in unmeasured else None
+                                  for path in (f'/Ac/L{i}/Energy/Forward', f'/Ac/L{i}/Energy/Reverse')))
+            for i in range(1, 4) if f'/Ac/L{i}/Power' in channels]
+        integrated = [phase for phase in integrated if phase[1] is not None or phase[2] is not None]
+        self._integrator = EnergyIntegrator(
+            integrated, tuple(path if path in paths else None for path in ('/Ac/Energy/Forward', '/Ac/Energy/Reverse')),
+            channels) if integrated else None
+        # everything else the meter does not send is derived from what it sends
+        self._derivations = Derivations(
+            paths, set(channels).union(path for phase in integrated for path in phase[1:] if path is not None))
+
+        logging.debug(f"{servicename} / DeviceInstance = {deviceinstance}")
+
+        startup_timer.mark('bus registration')
+
+        # All paths are exported with add_paths(), which creates the tree nodes once for all of them
+        mandatory = {
+            # Create the management objects, as specified in the ccgx dbus-api document
+            '/Mgmt/ProcessName': {'value': os.path.realpath(sys.argv[0])},
+            '/Mgmt/ProcessVersion': {'value': 'running on Python ' + platform.python_version()},
+            '/Mgmt/Connection': {'value': connection},
+
+            # Create the mandatory objects
+            '/DeviceInstance': {'value': deviceinstance},
+            '/ProductId': {'value': productid},
+
+            # DSTK_2022-10-25: from https://github.com/fabian-lauer/dbus-shelly-3em-smartmeter/blob/main/dbus-shelly-3em-smartmeter.py
+            # self._dbusservice.add_path('/ProductId', 45069) # found on https://www.sascha-curth.de/projekte/005_Color_Control_GX.html#experiment - should be an ET340 Engerie Meter
+            # found on https://www.sascha-curth.de/projekte/005_Color_Control_GX.html#experiment - should be an ET340 Engerie Meter
+            '/DeviceType': {'value': devicetype},
+            '/Role': {'value': role},
+
+            '/ProductName': {'value': productname},
+            '/FirmwareVersion': {'value': 0.1},
+            '/HardwareVersion': {'value': 0},
+            '/Connected': {'value': 0, 'valuetype': int},
+            '/Position': {'value': position},  # DSTK_2022-10-25 bewirkt bei Gridmeter nichts ???
+            '/UpdateIndex': {'value': 0, 'valuetype': int},
+            '/Serial': {'value': 1234},
+        }
+        if devicetype is None:
+            del mandatory['/DeviceType']
+        self._vedbusservice.add_paths(mandatory)
+
+        self._vedbusservice.add_paths(
+            {path: {'value': settings['initial'], 'textformat': settings['textformat'],
+                    'valuetype': settings.get('valuetype', float)} for path, settings in self._paths.items()},
+            writeable=True, onchangecallback=self._handlechangedvalue)
+
+        self._init_stats(channels)
+        self._init_snapshot(snapshot, f'{servicename}/{deviceinstance}')
+        self._startup_pending = '/Ac/Power' in self._paths
+        startup_timer.mark('path export')
+
+        self._last_update = 0
+        sign_of_life_id = gobject.timeout_add(10 * 1000, self._sign_of_life)
+        logging.debug(f"sign_of_life_id = {sign_of_life_id}")
+
+    def update(self, values=None, gridloss=False, received=None):
+        '''
+        values: dict D-Bus path -> new value
+        received: dict D-Bus path -> time.monotonic() when the value was received, None for held values
+                  published late, which are no sign of life of the source
+        '''
+
+        if gridloss:
+            self._degrade(invalidate=True)
+            return
+
+        integrated = {}
+        if received is not None:
+            self._last_update = time.time()
+            self._received.update(received)
+            if self._integrator is not None:
+                # the raw values, a power value held back by its policy still counts for the energy
+                integrated = self._integrator.add(values, received)
+
+        values = self._apply_policies(values)
+        if not values and not integrated:
+            return
+        degraded_since, self._degraded_since = self._degraded_since, None
+        values.update(integrated)
+        derived = self._derivations.update(values)
+        restored = len(self._restored)
+        if restored:
+            # a derived path is live when one of the values it is derived from is
+            self._restored = {
+                path for path in self._restored if path not in values and path not in derived
+                and values.keys().isdisjoint(self._derivations.inputs.get(path, ()))}
+
+        # batch all changes of this update into one ItemsChanged signal
+        with self._vedbusservice as s:
+            s['/Connected'] = 1
+            if len(self._restored) != restored:
+                s['/Mgmt/Stats/Restored'] = len(self._restored)
+
+            for path, value in values.items():
+                s[path] = value  # /Ac/Power positive: consumption, negative: feed into grid
+                log_value(value, path)
+            for path, value in derived.items():
+                s[path] = value
+
+            self.update_dbus_index(s)
+
+        self._updates_published += 1
+        committed = time.monotonic()
+        for path in values:
+            histogram = self._latency.get(path)
+            if histogram is not None and path in self._received:
+                histogram.add((committed - self._received.pop(path)) * 1000)
+        if degraded_since is not None:
+            self._recovered(degraded_since, committed, received)
+        if self._startup_pending and (values.get('/Ac/Power') is not None or derived.get('/Ac/Power') is not None):
+            self._startup_pending = False
+            total = startup_timer.finish('first value')
+            if total is not None:
+                self._vedbusservice['/Mgmt/Stats/StartupTime'] = round(total * 1000, 1)
+
+    def _degrade(self, invalidate):
+        '''
+        Degraded mode while no data arrives: /Connected is 0 and, with invalidate, all measured values are
+        invalid. The service stays on the bus and the next update resumes it.
+        '''
+        if self._degraded_since is not None:
+            return
+        self._degraded_since = time.monotonic()
+        logging.warning(f"{self._role}: no data, {'invalidating the values' if invalidate else 'disconnected'} "
+                        "until data arrives again")
+
+        # nothing held back may be published late, and the first fresh value must go through right away
+        if self._held_timer is not None:
+            gobject.source_remove(self._held_timer)
+            self._held_timer = None
+        for policy in self._policies.values():
+            policy.reset()
+        self._received.clear()
+        if self._integrator is not None:
+            self._integrator.reset()
+        if invalidate:
+            self._derivations.reset()
+            if self._snapshot is not None:
+                # the last valid counters, a later save keeps them for the invalidated paths
+                self._save_snapshot()
+
+        with self._vedbusservice as s:
+            s['/Connected'] = 0
+            if invalidate:
+                for path in self._paths:
+                    s[path] = None
+                self._restored.clear()
+                s['/Mgmt/Stats/Restored'] = 0
+                self.update_dbus_index(s)
+
+    def _recovered(self, degraded_since, committed, received):
+        ''' received: the receive times of the update that ended the degraded mode '''
+        outage = committed - degraded_since
+        recovery = committed - min(received.values()) if received else None
+        self._recoveries += 1
+        self._stale_retry_at = 0
+        self._stale_retry_delay = SOURCE_RETRY_MIN
+        logging.info(f"{self._role}: data again after {outage:.1f}s"
+                     + (f", published {recovery * 1000:.1f}ms after it was received" if recovery is not None else ""))
+        with self._vedbusservice as s:
+            s['/Mgmt/Stats/Recoveries'] = self._recoveries
+            s['/Mgmt/Stats/LastOutage'] = round(outage, 1)
+            if recovery is not None:
+                s['/Mgmt/Stats/RecoveryTime'] = round(recovery * 1000, 2)
+
+    def _apply_policies(self, values):
+        ''' returns the values to be published now, held back values are published by a timer when due '''
+        now = time.monotonic()
+        published = {}
+        held_until = None
+        for path, value in values.items():
+            policy = self._policies.get(path)
+            if policy is None or policy.offer(value, now):
+                published[path] = value
+            elif policy.held_until is not None:
+                held_until = policy.held_until if held_until is None else min(held_until, policy.held_until)
+
+        if held_until is not None:
+            self._schedule_held(held_until, now)
+        return published
+
+    def _schedule_held(self, due, now):
+        ''' the held timer fires at the earliest due time, a later timer is replaced '''
+        if self._held_timer is not None:
+            if self._held_due <= due:
+                return
+            gobject.source_remove(self._held_timer)
+        self._held_due = due
+        self._held_timer = gobject.timeout_add(max(1, int((due - now) * 1000)), self._publish_held)
+
+    def _publish_held(self):
+        self._held_timer = None
+        now = time.monotonic()
+        held = {
+            path: policy.held for path, policy in self._policies.items()
+            if policy.held_until is not None and policy.held_until <= now}
+        if held:
+            self.update(held)
+
+        # values held back later than this timer was scheduled for need another one
+        pending = [policy.held_until for policy in self._policies.values() if policy.held_until is not None]
+        if pending:
+            self._schedule_held(min(pending), now)
+        return False
+
+    def update_dbus_index(self, s):
+        ''' increment UpdateIndex - to show that new data is available '''
+        index = s[path_UpdateIndex] + 1  # increment index
+        if index > 255:   # maximum value of the index
+            index = 0       # overflow from 255 to 0
+            self._index_wraps += 1
+        s[path_UpdateIndex] = index
+
+    def _init_stats(self, channels):
+        ''' channels: dict D-Bus path -> name of its source channel, the latency is published per channel '''
+        self._updates_published = 0
+        self._index_wraps = 0
+        self._recoveries = 0
+        self._latency = {path: LatencyHistogram() for path in channels}
+        self._latency_paths = {
+            path: '/Mgmt/Stats/Latency/' + re.sub('[^A-Za-z0-9_]', '_', name) for path, name in channels.items()}
+        self._stats_last = (time.monotonic(), 0, 0, 0, 0)
+
+        stats = {}
+        for name in ('MessagesReceived', 'MessagesDropped', 'UpdatesPublished', 'UpdateIndexWraps'):
+            stats[f'/Mgmt/Stats/{name}'] = {'value': 0, 'valuetype': int}
+            stats[f'/Mgmt/Stats/{name}Rate'] = {'value': None, 'textformat': _per_s, 'valuetype': float}
+        # leaving the degraded mode: how often, how long without data, ms from receiving the first value to D-Bus
+        stats['/Mgmt/Stats/Recoveries'] = {'value': 0, 'valuetype': int}
+        stats['/Mgmt/Stats/LastOutage'] = {'value': None, 'textformat': _s, 'valuetype': float}
+        stats['/Mgmt/Stats/RecoveryTime'] = {'value': None, 'textformat': _ms, 'valuetype': float}
+        # ms from the process start until the first /Ac/Power was published, see dbusmeter.startup
+        stats['/Mgmt/Stats/StartupTime'] = {'value': None, 'textformat': _ms, 'valuetype': float}
+        for prefix in self._latency_paths.values():
+            for name in ('P50', 'P99', 'Max'):
+                stats[f'{prefix}/{name}'] = {'value': None, 'textformat': _ms, 'valuetype': float}
+            stats[f'{prefix}/Count'] = {'value': 0, 'valuetype': int}
+            stats[f'{prefix}/Buckets'] = {'value': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+        self._vedbusservice.add_paths(stats)
+        gobject.timeout_add(STATS_INTERVAL * 1000, self._publish_stats)
+
+    def _init_snapshot(self, filename, identity):
+        ''' restores the values of the snapshot, they count as restored until live data replaces them '''
+        self._snapshot = None
+        self._restored = set()
+        self._vedbusservice.add_path('/Mgmt/Stats/Restored', 0, valuetype=int)
+        if filename is None:
+            return
+
+        self._snapshot = Snapshot(filename, [path for path, settings in self._paths.items() if settings.get('persist')],
+                                  identity)
+        restored = self._snapshot.load()
+        with self._vedbusservice as s:
+            for path, value in restored.items():
+                s[path] = value
+            s['/Mgmt/Stats/Restored'] = len(restored)
+        self._restored = set(restored)
+        if self._integrator is not None:
+            self._integrator.restore(restored)
+        self._derivations.restore(restored)
+        gobject.timeout_add(SNAPSHOT_INTERVAL * 1000, self._save_snapshot)
+        atexit.register(self._save_snapshot)
+
+    def _save_snapshot(self):
+        self._snapshot.save({path: self._vedbusservice[path] for path in self._snapshot.paths})
+        return True  # keep the timer running
+
+    def _publish_stats(self):
+        now = time.monotonic()
+        totals = (message_counters.received, message_counters.dropped, self._updates_published, self._index_wraps)
+        last = self._stats_last
+        self._stats_last = (now,) + totals
+        seconds = now - last[0]
+
+        with self._vedbusservice as s:
+            for i, name in enumerate(('MessagesReceived', 'MessagesDropped', 'UpdatesPublished', 'UpdateIndexWraps')):
+                s[f'/Mgmt/Stats/{name}'] = totals[i]
+                s[f'/Mgmt/Stats/{name}Rate'] = round((totals[i] - last[i + 1]) / seconds, 2)
+            for path, prefix in self._latency_paths.items():
+                histogram = self._latency[path]
+                s[f'{prefix}/P50'], s[f'{prefix}/P99'], s[f'{prefix}/Max'] = histogram.take_window()
+                s[f'{prefix}/Count'] = sum(histogram.counts)
+                s[f'{prefix}/Buckets'] = list(histogram.counts)
+        return True  # keep the timer running
+
+    def _sign_of_life(self):
+        now = time.time()
+        last_update_ago_seconds = now - self._last_update
+        if last_update_ago_seconds > STALE_SECONDS:
+            logging.warning(f"last update was {last_update_ago_seconds} seconds ago.")
+            # a pv inverter that is silent at night keeps its last values, only /Connected goes to 0. Any other
+            # meter must not leave its last power values to the ESS.
+            self._degrade(invalidate=self._role != 'pvinverter')
+            self._retry_source()
+        else:
+            logging.debug(f"ok: last update was {last_update_ago_seconds} seconds ago.")
+        return True  # must return True if it wants to be rescheduled
+
+    def _retry_source(self):
+        if self._on_stale is None or time.monotonic() < self._stale_retry_at:
+            return
+        self._stale_retry_at = time.monotonic() + self._stale_retry_delay
+        self._stale_retry_delay = min(self._stale_retry_delay * 2, SOURCE_RETRY_MAX)
+        self._on_stale()
+
+    @property
+    def stale(self):
+        ''' True while no data arrives, see _degrade() '''
+        return self._degraded_since is not None
+
+    def _handlechangedvalue(self, path, value):
+        logging.debug(f"someone else updated {path} to {value}")
+        return True  # accept the change
+
+
+def dbusconnection():
+    ''' every service needs its own connection, as they all export the same object paths (/Ac/Power, ...) '''
+    if 'DBUS_SESSION_BUS_ADDRESS' in os.environ:
+        return BusConnection(BusConnection.TYPE_SESSION)
+    return BusConnection(BusConnection.TYPE_SYSTEM)
+
+
+def run_mainloop():
+    '''
+    Runs the GLib main loop until SIGTERM (kill_me.sh, restart.sh, svc -t). The signal only quits the loop, so
+    the process ends normally and the atexit handlers run: the snapshots are saved and the queued log records
+    are written. Killed by the default SIGTERM action, they would be lost.
+    '''
+    mainloop = gobject.MainLoop()
+
+    def _terminate():
+        logging.info("SIGTERM received, exiting")
+        mainloop.quit()
+        return False  # remove the handler, a second SIGTERM kills right away
+
+    gobject.unix_signal_add(gobject.PRIORITY_HIGH, signal.SIGTERM, _terminate)
+    mainloop.run()
+
+
+class DeviceRegistry:
+    '''
+    All D-Bus devices of this process, by their name in the devices config.
+
+    devices:  dict name -> settings, see DEVICES in MQTTtoGridMeter.py
+    channels: dict (device, path) -> channel name, the union of the channels() of all sources
+    on_stale: see MeterService, usually the stale() of the source. Called only when all devices fed by the
+              source are stale, so a pv inverter that is silent at night does not reconnect the grid meter.
+    snapshot_dir: directory of the snapshots, one <device name>.snapshot per device. None: no snapshots
+    '''
+
+    def __init__(self, devices, channels, bus_factory=dbusconnection, itemsignals=False, lazytext=False,
+                 on_stale=None, snapshot_dir=None):
+        for device, path in channels:
+            if device not in devices or path not in DEVICE_CLASSES[devices[device]['deviceclass']]['paths']:
+                raise ValueError(f"no D-Bus path {path} for device {device}, check the source config")
+
+        self._on_stale = on_stale
+        self._stale_at = None  # time.monotonic() of the last on_stale call
+        self._fed = {device for device, _ in channels}
+        self._devices = {}
+        for name, settings in devices.items():
+            deviceclass = DEVICE_CLASSES[settings['deviceclass']]
+            self._devices[name] = MeterService(
+                servicename=settings['servicename'],
+                deviceinstance=settings['deviceinstance'],  # = VRM instance ID
+                paths=deviceclass['paths'],
+                productname=settings['productname'],
+                connection=settings['connection'],
+                role=settings['deviceclass'],
+                productid=settings.get('productid', deviceclass['productid']),
+                devicetype=deviceclass['devicetype'],
+                position=settings.get('position', 0),
+                bus=bus_factory(),
+                channels={path: channel for (device, path), channel in channels.items() if device == name},
+                itemsignals=itemsignals,
+                lazytext=lazytext,
+                on_stale=self._source_stale if on_stale is not None else None,
+                snapshot=os.path.join(snapshot_dir, f'{name}.snapshot') if snapshot_dir is not None else None)
+            logging.info(f"Connected to dbus as {settings['servicename']}")
+
+    def __getitem__(self, name):
+        return self._devices[name]
+
+    def _source_stale(self):
+        ''' a device backs off its calls, but with several stale devices each one calls: at most one per minimum '''
+        if not all(self._devices[device].stale for device in self._fed if device in self._devices):
+            return
+        now = time.monotonic()
+        if self._stale_at is not None and now - self._stale_at < SOURCE_RETRY_MIN:
+            return
+        self._stale_at = now
+        self._on_stale()
+
+    def update(self, pending):
+        ''' pending: dict (device, path) -> (value, time received), as collected by the CoalescingQueue '''
+        values = {}
+        received = {}
+        for (device, path), (value, t) in pending.items():
+            values.setdefault(device, {})[path] = value
+            received.setdefault(device, {})[path] = t
+        for device, device_values in values.items():
+            self._devices[device].update(device_values, received=received[device])
@@ -0,0 +1,143 @@
+'''
+Energy counters integrated from the power of each phase, for meters that send the energy rarely or only as a total.
+
+The power samples of a phase are integrated with the trapezoidal rule, split at zero crossings into imported
+(power > 0, Forward) and exported (power < 0, Reverse) energy. Across a gap of more than MAX_GAP seconds nothing is
+integrated, the energy of the gap is only recovered by the next absolute counter.
+
+Whenever the meter sends an absolute total counter, the phase counters are resynchronized to it: the energy the
+meter counted since the last total is distributed over the phases in proportion to what they integrated in that
+time, so the phases add up to the meter again. If the phases integrated only a small part of it, e.g. after a gap
+or at the first total after a restore, which also holds the energy since the snapshot, how it was shared is unknown
+and it is split evenly. A counter never decreases. If the integration ran ahead of the meter, the counter holds
+until the meter has caught up.
+'''
+
+MAX_GAP = 30  # seconds between two power samples of a phase, longer gaps are not integrated
+SHARE_RATIO = 10  # the meter counted more than this times what the phases counted: split evenly, not by share
+DIGITS = 2  # kWh, the counters are published rounded to 10 Wh, so a few W do not cause a signal per sample
+
+WS_PER_KWH = 3.6e6
+
+
+def trapezoid(p0, p1, seconds):
+    ''' returns the (imported, exported) energy in kWh between two power samples in W, both >= 0 '''
+    if p0 >= 0 and p1 >= 0:
+        return (p0 + p1) / 2 * seconds / WS_PER_KWH, 0.0
+    if p0 <= 0 and p1 <= 0:
+        return 0.0, -(p0 + p1) / 2 * seconds / WS_PER_KWH
+    # the sign changes: two triangles, split where the line crosses zero
+    crossing = seconds * p0 / (p0 - p1)
+    first = p0 * crossing / 2 / WS_PER_KWH
+    second = p1 * (seconds - crossing) / 2 / WS_PER_KWH
+    return (first, -second) if p0 > 0 else (second, -first)
+
+
+class _Counter:
+    ''' one direction of one phase '''
+
+    __slots__ = ('anchor', 'integrated', 'value', 'restored')
+
+    def __init__(self):
+        self.anchor = None  # kWh at the last resync, None until the first total or restore
+        self.integrated = 0.0  # kWh since then
+        self.value = None  # published value, never decreases
+        self.restored = False  # the anchor is from a restore, not yet resynced
+
+
+class EnergyIntegrator:
+    '''
+    phases: list of (power path, forward energy path, reverse energy path), a None energy path is not integrated
+    totals: (forward total path, reverse total path) of the absolute meter counters
+    measured: the paths the meter sends. Without a measured total the phase counters start at 0 (or the restored
+              value), the total is then derived from them, see dbusmeter.derive
+    '''
+
+    def __init__(self, phases, totals, measured, max_gap=MAX_GAP):
+        self._max_gap = max_gap
+        self._last = {}  # power path -> (time, power) of the previous sample
+        self._republish = False
+        self._phases = {}  # power path -> (forward counter, reverse counter)
+        self._directions = []  # per direction: total path, whether it is measured, [(energy path, counter)]
+        for index, total in enumerate(totals):
+            counters = [(phase[1 + index], _Counter()) for phase in phases if phase[1 + index] is not None]
+            if total is None or not counters:
+                continue
+            if total not in measured:
+                for _, counter in counters:
+                    counter.anchor = 0.0
+            self._directions.append((total, total in measured, counters))
+        counters = {path: counter for _, _, direction in self._directions for path, counter in direction}
+        for power, forward, reverse in phases:
+            self._phases[power] = (counters.get(forward), counters.get(reverse))
+
+    def restore(self, values):
+        ''' values: dict energy path -> kWh, e.g. from the snapshot. Phase counters continue from there. '''
+        for _, _, direction in self._directions:
+            for path, counter in direction:
+                if values.get(path) is not None:
+                    counter.anchor = counter.value = values[path]
+                    counter.integrated = 0.0
+                    counter.restored = True
+
+    def reset(self):
+        ''' the data was interrupted: do not integrate from the last samples, publish all counters again '''
+        self._last.clear()
+        self._republish = True
+
+    def add(self, values, received):
+        '''
+        values: dict D-Bus path -> value, received: dict D-Bus path -> time.monotonic() when received
+        Returns a dict energy path -> kWh of the counters that changed.
+        '''
+        for path, (forward, reverse) in self._phases.items():
+            power = values.get(path)
+            t = received.get(path)
+            if power is None or t is None:
+                continue
+            last = self._last.get(path)
+            self._last[path] = (t, power)
+            if last is None or not 0 < t - last[0] <= self._max_gap:
+                continue
+            imported, exported = trapezoid(last[1], power, t - last[0])
+            if forward is not None:
+                forward.integrated += imported
+            if reverse is not None:
+                reverse.integrated += exported
+
+        changed = {}
+        for total, measured, direction in self._directions:
+            if measured and values.get(total) is not None:
+                self._resync(values[total], direction)
+            for path, counter in direction:
+                if counter.anchor is None:
+                    continue
+                value = max(counter.value or 0.0, counter.anchor + counter.integrated)
+                if self._republish or counter.value is None or round(value, DIGITS) != round(counter.value, DIGITS):
+                    changed[path] = round(value, DIGITS)
+                counter.value = value
+        self._republish = False
+        return changed
+
+    @staticmethod
+    def _resync(total, direction):
+        counters = [counter for _, counter in direction]
+        if any(counter.anchor is None for counter in counters):
+            # first total without restored counters: split it evenly, like the meters without phase counters
+            for counter in counters:
+                counter.anchor = total / len(counters)
+                counter.integrated = 0.0
+            return
+
+        counted = total - sum(counter.anchor for counter in counters)
+        # what each phase counted since its anchor, also what it published ahead of the meter at the last resync
+        seen = [max(counter.integrated, (counter.anchor if counter.value is None else counter.value) - counter.anchor)
+                for counter in counters]
+        integrated = sum(seen)
+        # the phases saw only a small part of what the meter counted, e.g. the energy since the snapshot
+        evenly = integrated <= 0 or counted > integrated * SHARE_RATIO or any(counter.restored for counter in counters)
+        for counter, phase in zip(counters, seen):
+            share = 1 / len(counters) if evenly else phase / integrated
+            counter.anchor += counted * share
+            counter.integrated = 0.0
+            counter.restored = False
@@ -0,0 +1,104 @@
+'''
+Logging that never blocks the main loop or a source thread.
+'''
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import socket
+
+from gi.repository import GLib as gobject
+
+LOG_FILE_MAX_BYTES = 256 * 1024  # the log file is rotated at this size, one backup is kept
+LOG_FILE_BUFFER = 50  # records collected before the log file is written, warnings are written at once
+LOG_FILE_FLUSH_SECONDS = 60  # ... or after this time
+
+# put into the log queue to have the listener thread flush the handlers, see _QueueListener
+FLUSH = logging.makeLogRecord({'msg': 'flush'})
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    ''' writes the records from the queue, and flushes the handlers in its thread when it takes FLUSH '''
+
+    def handle(self, record):
+        if record is FLUSH:
+            for handler in self.handlers:
+                handler.flush()
+        else:
+            super().handle(record)
+
+
+def init_logging(level=logging.INFO, logfile=None, ident='dbusmeter', defer=False):
+    '''
+    The root logger only puts records into a queue. A QueueListener thread writes them to stdout, syslog and
+    logfile (if given), so a slow syslog or flash write never blocks the main loop or a source thread.
+    defer: set up the handlers and the listener only when the GLib main loop runs, so they do not delay the
+           D-Bus registration. The records logged until then wait in the queue.
+    '''
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    atexit.register(stop_logging)
+
+    def _start():
+        if init_logging.pending is not _start:  # already started by stop_logging()
+            return False
+        init_logging.pending = None
+
+        log_format = "%(asctime)s,%(msecs)d %(levelname)s %(message)s"
+        date_format = "%Y-%m-%d %H:%M:%S"
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(log_format, date_format))
+
+        syslog_handler = logging.handlers.SysLogHandler(address="/dev/log")
+        syslog_handler.setFormatter(logging.Formatter(
+            f"{socket.gethostname()} {ident} {log_format}", date_format))
+        handlers = [stream_handler, syslog_handler]
+
+        buffered_file_handler = None
+        if logfile is not None:
+            # /data is flash: limit the size of the log file and write it in chunks
+            file_handler = logging.handlers.RotatingFileHandler(
+                logfile, maxBytes=LOG_FILE_MAX_BYTES, backupCount=1, delay=True)
+            file_handler.setFormatter(logging.Formatter(log_format, date_format))
+            buffered_file_handler = logging.handlers.MemoryHandler(
+                LOG_FILE_BUFFER, flushLevel=logging.WARNING, target=file_handler)
+            buffered_file_handler.setLevel(level=logging.INFO)
+            handlers.append(buffered_file_handler)
+
+        listener = _QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        init_logging.listener = listener
+
+        if buffered_file_handler is not None:
+            def _flush_log_file():
+                log_queue.put(FLUSH)  # the write to flash is done by the listener thread
+                return True  # keep the timer running
+            gobject.timeout_add(LOG_FILE_FLUSH_SECONDS * 1000, _flush_log_file)
+        return False  # run once when deferred
+
+    init_logging.pending = _start
+    if defer:
+        gobject.idle_add(_start)
+    else:
+        _start()
+
+
+init_logging.listener = None
+init_logging.pending = None  # the deferred start of the handlers
+
+
+def stop_logging():
+    ''' write out all queued log records and flush the handlers '''
+    if init_logging.pending is not None:
+        init_logging.pending()
+    listener = init_logging.listener
+    if listener is None:
+        return
+    init_logging.listener = None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
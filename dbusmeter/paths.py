@@ -0,0 +1,71 @@
+'''
+D-Bus paths exported by the meter services, with their text format and publish policy.
+All values are published as D-Bus Double, unless a path sets another 'valuetype'.
+Paths with 'persist' are kept in the snapshot (see dbusmeter.snapshot) and restored at startup.
+'''
+
+# text formats, see VeDbusService.add_path(textformat=...)
+_kwh = '{:.2f}kWh'
+_wh = '{:.2f}Wh'
+_a = '{:.2f}A'
+_w = '{:.0f}W'
+_v = '{:.1f}V'
+_hz = '{:.2f}Hz'
+_s = '{}s'
+_ms = '{}ms'
+_per_s = '{}/s'
+
+
+# publish policies of the measured values, see PublishPolicy
+POWER_POLICY = {'deadband': 1, 'mininterval': 0.2, 'maxinterval': 5}
+ENERGY_POLICY = {'mininterval': 2, 'maxinterval': 60}  # counters at 1/10 the rate of the power values
+
+# see https://github.com/victronenergy/venus/wiki/dbus#grid-and-genset-meter
+METER_PATHS = {
+    '/Ac/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    '/Ac/L1/Voltage': {'initial': None, 'textformat': _v},
+    '/Ac/L2/Voltage': {'initial': None, 'textformat': _v},
+    '/Ac/L3/Voltage': {'initial': None, 'textformat': _v},
+    '/Ac/L1/Current': {'initial': None, 'textformat': _a},
+    '/Ac/L2/Current': {'initial': None, 'textformat': _a},
+    '/Ac/L3/Current': {'initial': None, 'textformat': _a},
+    '/Ac/L1/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    '/Ac/L2/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    '/Ac/L3/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    # energy bought from / sold to the grid
+    '/Ac/Energy/Forward': {'initial': None, 'textformat': _kwh, 'policy': ENERGY_POLICY, 'persist': True},
+    '/Ac/Energy/Reverse': {'initial': None, 'textformat': _kwh, 'policy': ENERGY_POLICY, 'persist': True},
+
+    '/Ac/L1/Energy/Forward': {'initial': None, 'textformat': _kwh, 'persist': True},  # energy bought from the grid
+    '/Ac/L2/Energy/Forward': {'initial': None, 'textformat': _kwh, 'persist': True},  # energy bought from the grid
+    '/Ac/L3/Energy/Forward': {'initial': None, 'textformat': _kwh, 'persist': True},  # energy bought from the grid
+    '/Ac/L1/Energy/Reverse': {'initial': None, 'textformat': _kwh, 'persist': True},  # energy sold to the grid
+    '/Ac/L2/Energy/Reverse': {'initial': None, 'textformat': _kwh, 'persist': True},  # energy sold to the grid
+    '/Ac/L3/Energy/Reverse': {'initial': None, 'textformat': _kwh, 'persist': True},  # energy sold to the grid
+}
+
+# see https://github.com/victronenergy/venus/wiki/dbus#pv-inverters
+PVINVERTER_PATHS = {
+    '/Ac/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    '/Ac/L1/Voltage': {'initial': None, 'textformat': _v},
+    '/Ac/L2/Voltage': {'initial': None, 'textformat': _v},
+    '/Ac/L3/Voltage': {'initial': None, 'textformat': _v},
+    '/Ac/L1/Current': {'initial': None, 'textformat': _a},
+    '/Ac/L2/Current': {'initial': None, 'textformat': _a},
+    '/Ac/L3/Current': {'initial': None, 'textformat': _a},
+    '/Ac/L1/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    '/Ac/L2/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    '/Ac/L3/Power': {'initial': None, 'textformat': _w, 'policy': POWER_POLICY},
+    # energy produced
+    '/Ac/Energy/Forward': {'initial': None, 'textformat': _kwh, 'policy': ENERGY_POLICY, 'persist': True},
+    '/Ac/L1/Energy/Forward': {'initial': None, 'textformat': _kwh, 'persist': True},
+    '/Ac/L2/Energy/Forward': {'initial': None, 'textformat': _kwh, 'persist': True},
+    '/Ac/L3/Energy/Forward': {'initial': None, 'textformat': _kwh, 'persist': True},
+}
+
+DEVICE_CLASSES = {
+    # 45069 = value used in ac_sensor_bridge.cpp of dbus-cgwacs
+    'grid': {'paths': METER_PATHS, 'productid': 45069, 'devicetype': 345},
+    'acload': {'paths': METER_PATHS, 'productid': 45069, 'devicetype': 345},
+    'pvinverter': {'paths': PVINVERTER_PATHS, 'productid': 0xFFFF, 'devicetype': None},
+}
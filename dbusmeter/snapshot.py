@@ -0,0 +1,92 @@
+'''
+Snapshot of the last known values of a meter service, so that after a restart the energy counters are on D-Bus
+right away instead of after the next energy message, which may take minutes.
+
+The file has a fixed layout, all numbers little endian:
+
+    header: b'DMSS', version (uint16), number of values (uint16), layout (uint32), saved at (float64, time.time())
+    values: one float64 per path, in the order of the paths, NaN for a value that was never known
+
+layout is the crc32 of the service identity and the paths, a snapshot of another service or of another set of
+paths is ignored. The file is replaced atomically (write to a temporary file, fsync, rename), so a power loss
+leaves either the old or the new snapshot.
+'''
+
+import logging
+import math
+import os
+import struct
+import time
+import zlib
+
+MAGIC = b'DMSS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHId')
+
+# seconds between two writes, /data is flash. Unchanged values are not written at all.
+SNAPSHOT_INTERVAL = 300
+
+
+class Snapshot:
+    '''
+    filename: the snapshot file, e.g. /data/mqtttogrid/grid.snapshot
+    paths:    the D-Bus paths kept in the snapshot
+    identity: e.g. service name and device instance, a snapshot of another service does not match
+    '''
+
+    def __init__(self, filename, paths, identity=''):
+        self.filename = filename
+        self.paths = tuple(paths)
+        self._layout = zlib.crc32('\n'.join((identity,) + self.paths).encode('utf-8'))
+        self._values = struct.Struct(f'<{len(self.paths)}d')
+        self._saved = (None,) * len(self.paths)  # values of the last write, None where never known
+
+    def load(self):
+        ''' returns a dict path -> value of the stored values, empty if there is no matching snapshot '''
+        try:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            logging.warning(f"cannot read the snapshot {self.filename}: {e}")
+            return {}
+
+        if len(data) != HEADER.size + self._values.size:
+            logging.warning(f"ignoring the snapshot {self.filename}: wrong size")
+            return {}
+        magic, version, count, layout, saved_at = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or count != len(self.paths) or layout != self._layout:
+            logging.warning(f"ignoring the snapshot {self.filename}: other version or paths")
+            return {}
+
+        values = self._values.unpack_from(data, HEADER.size)
+        self._saved = tuple(None if math.isnan(v) else v for v in values)
+        logging.info(f"restored {sum(v is not None for v in self._saved)} values from {self.filename}, "
+                     f"saved {time.time() - saved_at:.0f}s ago")
+        return {path: value for path, value in zip(self.paths, self._saved) if value is not None}
+
+    def save(self, values):
+        '''
+        values: dict path -> current value. An invalid (None) value keeps the one saved before, so a meter that
+        is offline for a while does not lose its counters. Returns True if the file was written.
+        '''
+        current = tuple(values.get(path) for path in self.paths)
+        current = tuple(saved if value is None else value for value, saved in zip(current, self._saved))
+        if current == self._saved:
+            return False
+
+        data = HEADER.pack(MAGIC, VERSION, len(self.paths), self._layout, time.time()) + self._values.pack(
+            *(math.nan if value is None else value for value in current))
+        temporary = self.filename + '.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.filename)
+        except OSError as e:
+            logging.warning(f"cannot write the snapshot {self.filename}: {e}")
+            return False
+        self._saved = current
+        return True
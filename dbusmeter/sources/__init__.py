@@ -0,0 +1,128 @@
+'''
+Meter data sources.
+
+A source reads a meter in its own way and hands normalized readings to the publishing engine: it puts
+((device, D-Bus path), (value, time.monotonic() when received)) into the sink, a CoalescingQueue, from any
+thread. The sources are not imported here, each one pulls in its own dependencies (paho-mqtt, requests, ...).
+'''
+
+import logging
+import threading
+import time
+
+from dbusmeter.counters import message_counters
+
+# the poll interval (seconds between the start of two requests) adapts between these limits
+MIN_INTERVAL = 0.2  # while the power changes quickly
+MAX_INTERVAL = 5.0  # while the power is steady, e.g. at night
+BACKOFF_INTERVAL = 60.0  # longest wait while the device is unreachable
+POWER_STEP = 50.0  # W, a change of the watched value by this much between two polls is fast
+RESPONSE_SHARE = 0.25  # the device is busy answering at most this share of the time
+
+
+class PollScheduler:
+    '''
+    Chooses the delay until the next poll from the response time, the change of the power and errors.
+    The interval drops to min_interval when the power jumps by POWER_STEP, grows by half per steady poll
+    up to max_interval and doubles per failed poll up to BACKOFF_INTERVAL.
+    '''
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.response_time = 0.0  # smoothed
+        self.failures = 0
+        self._last_power = None
+
+    def next_delay(self, response_time, power=None):
+        ''' returns the seconds to wait after a poll that took response_time, power is None for a failed poll '''
+        if power is None:
+            self.failures += 1
+            self.interval = min(BACKOFF_INTERVAL, max(self.interval, self.min_interval) * 2)
+            return max(0, self.interval - response_time)
+
+        if self.failures:
+            logging.info(f"meter reachable again after {self.failures} failed polls")
+            self.failures = 0
+            self.interval = self.max_interval  # steady until the power says otherwise
+        self.response_time += (response_time - self.response_time) / 4
+        if self._last_power is not None and abs(power - self._last_power) >= POWER_STEP:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        self._last_power = power
+        # never keep a slow device busy all the time
+        self.interval = max(self.interval, self.response_time / RESPONSE_SHARE)
+        return max(0, self.interval - response_time)
+
+
+class Source:
+    ''' base class of the sources '''
+
+    def channels(self):
+        ''' dict (device, D-Bus path) -> channel name (MQTT topic, JSON key, ...) of all values this source delivers '''
+        raise NotImplementedError
+
+    def start(self, sink):
+        ''' start delivering readings into sink, must not block '''
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+    def stale(self):
+        ''' called by the engine while no values arrive, a source that keeps a connection may reconnect '''
+
+
+class PollingSource(Source):
+    '''
+    Base class of the sources that poll a device in a worker thread, so a slow or unreachable device never
+    blocks the D-Bus service. Subclasses implement poll() and may implement reset() and close().
+
+    watch: D-Bus path whose changes speed up the polling, see PollScheduler
+    '''
+
+    errors = (OSError, ValueError)  # a failed poll, the subclass may extend this
+
+    def __init__(self, device='grid', watch='/Ac/Power', scheduler=None, name='poller'):
+        self._device = device
+        self._watch = watch
+        self._scheduler = scheduler or PollScheduler()
+        self._sink = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def poll(self):
+        ''' returns a dict D-Bus path -> value of one reading, raises one of errors if the device failed '''
+        raise NotImplementedError
+
+    def reset(self):
+        ''' called after a failed poll, e.g. to drop the connection '''
+
+    def close(self):
+        ''' called when the worker thread ends '''
+
+    def start(self, sink):
+        self._sink = sink
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.time()
+            power = None
+            try:
+                values = self.poll()
+            except self.errors as e:
+                logging.warning(f"polling {self._thread.name} failed: {e}")
+                self.reset()
+            else:
+                received = time.monotonic()
+                message_counters.received += len(values)
+                self._sink.put_many(((self._device, path), (value, received)) for path, value in values.items())
+                power = values.get(self._watch, 0.0)
+            self._stop_event.wait(self._scheduler.next_delay(time.time() - started, power))
+        self.close()
@@ -0,0 +1,63 @@
+'''
+HTTP poll source: requests a JSON document in a worker thread, e.g. the Solar API of a Fronius inverter.
+requests is imported by start(), so it does not delay the D-Bus registration.
+'''
+
+import operator
+
+from dbusmeter.sources import PollingSource
+
+TIMEOUT = (1.0, 2.0)  # connect and read timeout of a request in seconds
+
+
+class HttpPollSource(PollingSource):
+    '''
+    Polls url over one keep-alive HTTP connection.
+
+    values:    list of (D-Bus path, key in the JSON object at data_path, factor)
+    data_path: keys leading from the JSON document to the object holding the values
+    '''
+
+    errors = (ValueError, KeyError, TypeError)  # start() adds requests.RequestException
+
+    def __init__(self, url, values, device='grid', data_path=(), watch='/Ac/Power', scheduler=None, timeout=TIMEOUT):
+        super().__init__(device, watch, scheduler, name=url)
+        self._url = url
+        self._data_path = tuple(data_path)
+        self._keys = tuple((device, path) for path, _, _ in values)
+        self._names = tuple(key for _, key, _ in values)
+        self._get_values = operator.itemgetter(*self._names)  # all keys in one go
+        self._factors = tuple(factor for _, _, factor in values)
+        self._timeout = timeout
+        self._session = None
+
+    def channels(self):
+        return dict(zip(self._keys, self._names))
+
+    def parse(self, document):
+        ''' returns a dict D-Bus path -> value from the decoded JSON document '''
+        data = document
+        for key in self._data_path:
+            data = data[key]
+        values = self._get_values(data)
+        if len(self._names) == 1:
+            values = (values,)
+        return {path: float(value) * factor for (_, path), value, factor in zip(self._keys, values, self._factors)}
+
+    def start(self, sink):
+        # imported only now, after the D-Bus services are registered
+        import requests  # pylint: disable=import-outside-toplevel
+        from requests.adapters import HTTPAdapter  # pylint: disable=import-outside-toplevel
+
+        self.errors = (requests.RequestException,) + self.errors
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        super().start(sink)
+
+    def poll(self):
+        response = self._session.get(url=self._url, timeout=self._timeout)
+        response.raise_for_status()
+        return self.parse(response.json())
+
+    def close(self):
+        self._session.close()
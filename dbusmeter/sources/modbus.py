@@ -0,0 +1,208 @@
+'''
+Modbus TCP source: reads the registers of a meter in as few block reads as possible and decodes each block
+with one precompiled struct.
+'''
+
+import socket
+import struct
+
+from dbusmeter.sources import PollingSource
+
+TIMEOUT = 2.0  # seconds for connect and each response
+MAX_BLOCK = 125  # registers per read, the limit of function 3 and 4
+MAX_GAP = 40  # unused registers read along rather than starting another block
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+
+# MBAP header (transaction id, protocol 0, length, unit) and the PDU of a read request
+REQUEST = struct.Struct('>HHHBBHH')
+# MBAP header, function and byte count - or the exception code if the function has the 0x80 bit set
+RESPONSE_HEADER = struct.Struct('>HHHBBB')
+
+# register type: struct format of its fields (big endian registers), number of registers
+REGISTER_TYPES = {
+    'uint16': ('H', 1),
+    'int16': ('h', 1),
+    'uint32': ('I', 2),
+    'int32': ('i', 2),
+    'float32': ('f', 2),
+    'int32sw': ('Hh', 2),  # int32 with the low word first (Carlo Gavazzi)
+}
+
+# per meter type: the read function, and per value the D-Bus path, name, register address, type and factor
+REGISTER_MAPS = {
+    # Eastron SDM630, input registers
+    'sdm630': {
+        'function': READ_INPUT_REGISTERS,
+        'values': [
+            ('/Ac/L1/Voltage', 'L1_Voltage', 0x0000, 'float32', 1),
+            ('/Ac/L2/Voltage', 'L2_Voltage', 0x0002, 'float32', 1),
+            ('/Ac/L3/Voltage', 'L3_Voltage', 0x0004, 'float32', 1),
+            ('/Ac/L1/Current', 'L1_Current', 0x0006, 'float32', 1),
+            ('/Ac/L2/Current', 'L2_Current', 0x0008, 'float32', 1),
+            ('/Ac/L3/Current', 'L3_Current', 0x000A, 'float32', 1),
+            ('/Ac/L1/Power', 'L1_Power', 0x000C, 'float32', 1),
+            ('/Ac/L2/Power', 'L2_Power', 0x000E, 'float32', 1),
+            ('/Ac/L3/Power', 'L3_Power', 0x0010, 'float32', 1),
+            ('/Ac/Power', 'Total_Power', 0x0034, 'float32', 1),
+            ('/Ac/Energy/Forward', 'Import_Energy', 0x0048, 'float32', 1),  # kWh
+            ('/Ac/Energy/Reverse', 'Export_Energy', 0x004A, 'float32', 1),
+            ('/Ac/L1/Energy/Forward', 'L1_Import_Energy', 0x015A, 'float32', 1),
+            ('/Ac/L2/Energy/Forward', 'L2_Import_Energy', 0x015C, 'float32', 1),
+            ('/Ac/L3/Energy/Forward', 'L3_Import_Energy', 0x015E, 'float32', 1),
+            ('/Ac/L1/Energy/Reverse', 'L1_Export_Energy', 0x0160, 'float32', 1),
+            ('/Ac/L2/Energy/Reverse', 'L2_Export_Energy', 0x0162, 'float32', 1),
+            ('/Ac/L3/Energy/Reverse', 'L3_Export_Energy', 0x0164, 'float32', 1),
+        ],
+    },
+    # Carlo Gavazzi EM24, holding registers
+    'em24': {
+        'function': READ_HOLDING_REGISTERS,
+        'values': [
+            ('/Ac/L1/Voltage', 'V_L1_N', 0x0000, 'int32sw', 0.1),
+            ('/Ac/L2/Voltage', 'V_L2_N', 0x0002, 'int32sw', 0.1),
+            ('/Ac/L3/Voltage', 'V_L3_N', 0x0004, 'int32sw', 0.1),
+            ('/Ac/L1/Current', 'A_L1', 0x000C, 'int32sw', 0.001),
+            ('/Ac/L2/Current', 'A_L2', 0x000E, 'int32sw', 0.001),
+            ('/Ac/L3/Current', 'A_L3', 0x0010, 'int32sw', 0.001),
+            ('/Ac/L1/Power', 'W_L1', 0x0012, 'int32sw', 0.1),
+            ('/Ac/L2/Power', 'W_L2', 0x0014, 'int32sw', 0.1),
+            ('/Ac/L3/Power', 'W_L3', 0x0016, 'int32sw', 0.1),
+            ('/Ac/Power', 'W_sys', 0x0028, 'int32sw', 0.1),
+            ('/Ac/Energy/Forward', 'kWh_plus_tot', 0x0034, 'int32sw', 0.1),
+            ('/Ac/L1/Energy/Forward', 'kWh_plus_L1', 0x0040, 'int32sw', 0.1),
+            ('/Ac/L2/Energy/Forward', 'kWh_plus_L2', 0x0042, 'int32sw', 0.1),
+            ('/Ac/L3/Energy/Forward', 'kWh_plus_L3', 0x0044, 'int32sw', 0.1),
+            ('/Ac/Energy/Reverse', 'kWh_minus_tot', 0x004E, 'int32sw', 0.1),
+        ],
+    },
+}
+
+
+class ModbusError(OSError):
+    pass
+
+
+class RegisterBlock:
+    ''' registers read with one request, decoded with one struct '''
+
+    def __init__(self, values):
+        ''' values: (path, name, address, type, factor) sorted by address, without overlaps '''
+        self.address = values[0][2]
+        fmt = '>'
+        self._fields = []  # (path, index of the first field, low word first, factor)
+        index = 0
+        end = self.address
+        for path, _, address, regtype, factor in values:
+            fields, size = REGISTER_TYPES[regtype]
+            if address > end:
+                fmt += f'{(address - end) * 2}x'
+            fmt += fields
+            self._fields.append((path, index, regtype == 'int32sw', factor))
+            index += len(fields)
+            end = address + size
+        self.count = end - self.address
+        self._struct = struct.Struct(fmt)
+
+    def decode(self, data, values):
+        ''' adds the values decoded from the registers in data to the dict values '''
+        fields = self._struct.unpack_from(data)
+        for path, index, swapped, factor in self._fields:
+            raw = fields[index] | (fields[index + 1] << 16) if swapped else fields[index]
+            values[path] = raw * factor
+
+
+def plan_blocks(values, max_block=MAX_BLOCK, max_gap=MAX_GAP):
+    ''' groups the values of a register map into as few RegisterBlocks as possible '''
+    values = sorted(values, key=lambda v: v[2])
+    groups = []
+    for value in values:
+        address, size = value[2], REGISTER_TYPES[value[3]][1]
+        if groups:
+            first = groups[-1][0][2]
+            last = groups[-1][-1]
+            end = last[2] + REGISTER_TYPES[last[3]][1]
+            if address - end <= max_gap and address + size - first <= max_block:
+                groups[-1].append(value)
+                continue
+        groups.append([value])
+    return [RegisterBlock(group) for group in groups]
+
+
+class ModbusTcpClient:
+    ''' minimal blocking Modbus TCP client, one request at a time '''
+
+    def __init__(self, host, port=502, unit=1, timeout=TIMEOUT):
+        self._address = (host, port)
+        self._unit = unit
+        self._timeout = timeout
+        self._sock = None
+        self._transaction = 0
+        self._buffer = bytearray(RESPONSE_HEADER.size + 2 * MAX_BLOCK)
+        self._view = memoryview(self._buffer)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def read_registers(self, function, address, count):
+        ''' returns a memoryview of the count registers, valid until the next read '''
+        if self._sock is None:
+            self._sock = socket.create_connection(self._address, timeout=self._timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._transaction = (self._transaction + 1) & 0xFFFF
+        self._sock.sendall(REQUEST.pack(self._transaction, 0, 6, self._unit, function, address, count))
+
+        header = self._view[:RESPONSE_HEADER.size]
+        self._recv_into(header)
+        transaction, _, _, _, response_function, length = RESPONSE_HEADER.unpack_from(header)
+        if response_function == function | 0x80:
+            raise ModbusError(f"exception {length} reading {count} registers at {address}")
+        if transaction != self._transaction or response_function != function or length != 2 * count:
+            raise ModbusError("unexpected response")
+
+        data = self._view[RESPONSE_HEADER.size:RESPONSE_HEADER.size + length]
+        self._recv_into(data)
+        return data
+
+    def _recv_into(self, view):
+        while view:
+            received = self._sock.recv_into(view)
+            if received == 0:
+                raise ModbusError("connection closed by the meter")
+            view = view[received:]
+
+
+class ModbusSource(PollingSource):
+    '''
+    Polls a meter over Modbus TCP.
+
+    registermap: name in REGISTER_MAPS
+    '''
+
+    def __init__(self, host, port=502, unit=1, registermap='sdm630', device='grid', watch='/Ac/Power',
+                 scheduler=None, timeout=TIMEOUT):
+        super().__init__(device, watch, scheduler, name=f"modbus://{host}:{port}/{unit}")
+        regmap = REGISTER_MAPS[registermap]
+        self._function = regmap['function']
+        self._blocks = plan_blocks(regmap['values'])
+        self._names = {(device, path): name for path, name, _, _, _ in regmap['values']}
+        self._client = ModbusTcpClient(host, port, unit, timeout)
+
+    def channels(self):
+        return dict(self._names)
+
+    def poll(self):
+        values = {}
+        for block in self._blocks:
+            block.decode(self._client.read_registers(self._function, block.address, block.count), values)
+        return values
+
+    def reset(self):
+        self._client.close()  # the next poll reconnects, a late response must not be taken for the next one
+
+    def close(self):
+        self._client.close()
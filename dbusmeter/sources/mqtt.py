@@ -0,0 +1,263 @@
+'''
+MQTT source: subscribes the configured topics, every message is one value.
+paho-mqtt is imported by start(), so it does not delay the D-Bus registration.
+'''
+
+import atexit
+import logging
+import socket
+import threading
+import time
+
+from gi.repository import GLib as gobject
+
+from dbusmeter import capture
+from dbusmeter.counters import message_counters
+from dbusmeter.sources import Source
+
+RECONNECT_MIN_DELAY = 1  # seconds, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 60
+CONNECT_TIMEOUT = 2  # seconds a connect attempt may take, with transport 'glib' in a worker thread
+
+# --capture: the capture file is written at least every CAPTURE_FLUSH_SECONDS, by a thread of the CaptureWriter
+CAPTURE_FLUSH_SECONDS = 10
+
+
+def compile_topics(topics):
+    ''' turn the TOPICS config into a dict topic -> ((device, path), scale, digits), so on_message needs one lookup '''
+    return {
+        topic: ((settings.get('device', 'grid'), settings['path']), settings.get('scale', 1), settings.get('digits'))
+        for topic, settings in topics.items()
+    }
+
+
+class MqttSource(Source):
+    '''
+    topics:    dict topic -> settings, see TOPICS in MQTTtoGridMeter.py
+    transport: 'thread': paho's own network thread (loop_start), 'glib': the MQTT socket is served by the
+               GLib main loop, see GLibMqttLoop
+    capture:   record all received messages to this file, see dbusmeter.capture
+    replay:    feed this capture file instead of connecting to the broker, at replay speed
+    '''
+
+    def __init__(self, topics, broker=None, clientname=None, username=None, password=None, transport='thread',
+                 capture=None, replay=None, speed=1.0):
+        self._topics = topics
+        self._table = compile_topics(topics)
+        self._broker = broker
+        self._clientname = clientname
+        self._username = username
+        self._password = password
+        self._transport = transport
+        self._capture = capture
+        self._replay = replay
+        self._speed = speed
+        self._client = None
+        self._loop = None
+        self._restarting = threading.Lock()
+
+    def channels(self):
+        return {key: topic.rsplit('/', 1)[-1] for topic, (key, _, _) in self._table.items()}
+
+    def start(self, sink):
+        if self._replay:
+            capture.replay(self._replay, self.on_message, sink, self._speed)
+            return
+
+        # imported only now, after the D-Bus services are registered
+        import paho.mqtt.client as mqtt  # pylint: disable=import-outside-toplevel
+
+        client = self._client = mqtt.Client(self._clientname, userdata=sink)  # create new instance
+        client.username_pw_set(self._username, self._password)
+        client.on_disconnect = self.on_disconnect
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        if self._capture is not None:
+            writer = capture.CaptureWriter(self._capture, list(self._topics), flush_seconds=CAPTURE_FLUSH_SECONDS)
+            client.on_message = capture.capturing(writer, self.on_message)
+            atexit.register(writer.close)
+
+        if self._transport == 'glib' and not GLibMqttLoop.supported(client):
+            logging.warning("this paho-mqtt cannot take a connected socket, using the MQTT transport 'thread'")
+            self._transport = 'thread'
+        if self._transport == 'glib':
+            client.connect_timeout = CONNECT_TIMEOUT
+            self._loop = GLibMqttLoop(client)
+            self._loop.start(self._broker)
+        else:
+            client.reconnect_delay_set(min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY)
+            # the network thread connects, with the reconnect backoff also while the broker is unreachable at boot
+            client.connect_async(self._broker)
+            client.loop_start()
+
+    def stale(self):
+        '''
+        No message for a while, the connection may be half-open: connect again. The broker keeps the retained
+        values, so the first messages arrive right after the new subscribe.
+        '''
+        if self._client is None:  # replay
+            return
+        if self._loop is not None:
+            self._loop.restart()
+        elif self._restarting.acquire(blocking=False):
+            # loop_stop() joins the network thread, which may sit in a blocking send: not on the main loop
+            threading.Thread(target=self._restart, name='mqtt-restart', daemon=True).start()
+
+    def _restart(self):
+        try:
+            logging.info("reconnecting to the MQTT broker")
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client.connect_async(self._broker)  # loop_start() connects, as in start()
+            self._client.loop_start()
+        finally:
+            self._restarting.release()
+
+    def on_disconnect(self, client, userdata, rc):  # pylint: disable=unused-argument
+        # the reconnect is done by paho's network thread or by GLibMqttLoop, never blocking in here
+        if rc == 0:
+            logging.info('MQTT disconnected')
+        else:
+            logging.info('Unexpected MQTT disconnection rc=%s. Will auto-reconnect', str(rc))
+
+    def on_connect(self, client, userdata, flags, rc):  # pylint: disable=unused-argument
+        if rc == 0:
+            logging.info("Connected to MQTT Broker!")
+            subscriptions = [(topic, settings.get('qos', 0)) for topic, settings in self._topics.items()]
+            ok = client.subscribe(subscriptions)
+            logging.debug("subscribed to %d topics ok=%s", len(subscriptions), str(ok))
+        else:
+            logging.warning(f"Failed to connect, return code {rc}\n")
+
+    def on_message(self, client, userdata, msg):  # pylint: disable=unused-argument
+        # runs on the paho network thread: only parse here and hand the value over to the GLib main loop
+        received = time.monotonic()
+        message_counters.received += 1
+        try:
+            entry = self._table.get(msg.topic)
+            if entry is None:
+                message_counters.dropped += 1
+                return
+
+            key, scale, digits = entry
+            value = float(msg.payload) * scale
+            if digits is not None:
+                value = round(value, digits)
+            userdata.put(key, (value, received))
+
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            message_counters.dropped += 1
+            logging.exception("MQTTtoGridMeter crashed during on_message", exc_info=e)
+
+
+class GLibMqttLoop:
+    '''
+    Serves the paho client from the GLib main loop instead of a network thread: the socket is watched with
+    GLib IO watches that call loop_read() / loop_write(), a timer calls loop_misc() for the keepalive.
+    All callbacks, including on_message, run on the main loop. Reconnects are scheduled with a timer and an
+    exponential backoff. The name lookup and the TCP connect run in a worker thread, so an unreachable broker
+    never blocks the main loop, only the connected socket is handed to paho on the main loop.
+    '''
+
+    def __init__(self, client):
+        self._client = client
+        self._address = None
+        self._connecting = False
+        self._read_watch = None
+        self._write_watch = None
+        self._reconnect_timer = None
+        self._reconnect_delay = RECONNECT_MIN_DELAY
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    @staticmethod
+    def supported(client):
+        ''' paho 1.x: reconnect() gets its socket from _create_socket_connection(), which _connected() replaces '''
+        return callable(getattr(client, '_create_socket_connection', None))
+
+    def start(self, host, port=1883):
+        self._client.connect_async(host, port)  # only stores the broker address
+        self._address = (host, port)
+        self._reconnect()
+        gobject.timeout_add(1000, self._misc)
+
+    def restart(self):
+        ''' disconnects, the socket close schedules the reconnect '''
+        if self._reconnect_timer is None and self._read_watch is not None:
+            self._client.disconnect()
+
+    def _reconnect(self):
+        self._reconnect_timer = None
+        if not self._connecting:
+            self._connecting = True
+            threading.Thread(target=self._connect, name='mqtt-connect', daemon=True).start()
+        return False
+
+    def _connect(self):
+        ''' worker thread: resolve and connect, the result goes back to the main loop '''
+        try:
+            sock = socket.create_connection(self._address, timeout=CONNECT_TIMEOUT)
+        except OSError as e:
+            gobject.idle_add(self._connect_failed, e)
+            return
+        gobject.idle_add(self._connected, sock)
+
+    def _connected(self, sock):
+        self._connecting = False
+        # paho 1.x has no API to adopt a connected socket, reconnect() takes it from _create_socket_connection()
+        self._client._create_socket_connection = lambda: sock  # pylint: disable=protected-access
+        try:
+            self._client.reconnect()  # sends CONNECT without blocking, the write watch flushes it
+        except (OSError, ValueError) as e:
+            sock.close()
+            self._connect_failed(e)
+        finally:
+            del self._client._create_socket_connection
+        return False
+
+    def _connect_failed(self, e):
+        self._connecting = False
+        logging.warning(f"MQTT connect failed: {e}, retry in {self._reconnect_delay}s")
+        self._schedule_reconnect()
+        return False
+
+    def _schedule_reconnect(self):
+        if self._reconnect_timer is None:
+            self._reconnect_timer = gobject.timeout_add(self._reconnect_delay * 1000, self._reconnect)
+            self._reconnect_delay = min(self._reconnect_delay * 2, RECONNECT_MAX_DELAY)
+
+    def _misc(self):
+        self._client.loop_misc()
+        return True  # keep the timer running
+
+    def _on_socket_open(self, client, userdata, sock):  # pylint: disable=unused-argument
+        self._reconnect_delay = RECONNECT_MIN_DELAY
+        self._read_watch = gobject.io_add_watch(sock, gobject.PRIORITY_DEFAULT, gobject.IO_IN, self._on_readable)
+
+    def _on_socket_close(self, client, userdata, sock):  # pylint: disable=unused-argument
+        for watch in (self._read_watch, self._write_watch):
+            if watch is not None:
+                gobject.source_remove(watch)
+        self._read_watch = None
+        self._write_watch = None
+        self._schedule_reconnect()
+
+    def _on_socket_register_write(self, client, userdata, sock):  # pylint: disable=unused-argument
+        if self._write_watch is None:
+            self._write_watch = gobject.io_add_watch(
+                sock, gobject.PRIORITY_DEFAULT, gobject.IO_OUT, self._on_writable)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):  # pylint: disable=unused-argument
+        if self._write_watch is not None:
+            gobject.source_remove(self._write_watch)
+            self._write_watch = None
+
+    def _on_readable(self, source, condition):  # pylint: disable=unused-argument
+        self._client.loop_read()
+        return self._read_watch is not None  # removed if the socket was closed while reading
+
+    def _on_writable(self, source, condition):  # pylint: disable=unused-argument
+        self._client.loop_write()
+        return self._write_watch is not None
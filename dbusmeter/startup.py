@@ -0,0 +1,55 @@
+'''
+Startup timing: how long it takes from the process start until the first valid /Ac/Power is on D-Bus,
+split into the phases of the startup. Logged once, and published as /Mgmt/Stats/StartupTime.
+'''
+
+import logging
+import os
+import time
+
+
+def process_age():
+    ''' seconds since this process was started, by the kernel's clock. 0 where /proc is not available '''
+    try:
+        with open('/proc/self/stat', encoding='ascii') as f:
+            # the fields after the command name, which is in parentheses and may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', encoding='ascii') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'))  # field 22, starttime
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    '''
+    Collects the time spent per phase. mark(phase) ends a phase, the time since the previous mark is added to
+    it, so a phase that runs once per device adds up. finish() ends the last phase and logs the report.
+    '''
+
+    def __init__(self):
+        self._started = time.monotonic() - process_age()
+        self._last = self._started
+        self.phases = {}  # phase -> seconds
+        self.total = None  # seconds from the process start until finish()
+
+    def mark(self, phase):
+        if self.total is not None:
+            return
+        now = time.monotonic()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def finish(self, phase):
+        ''' returns the seconds since the process start, None if already finished '''
+        if self.total is not None:
+            return None
+        self.mark(phase)
+        self.total = self._last - self._started
+        logging.info("startup: " + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+                     + f", total {self.total * 1000:.0f}ms")
+        return self.total
+
+
+# created when dbusmeter is imported, the first mark() covers the interpreter start and the imports
+startup_timer = StartupTimer()
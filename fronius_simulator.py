@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Local stand-in for the Solar API of a Fronius inverter with Smart Meter, to run
+dbus-fronius-smartmeter.py without the real device:
+
+  python fronius_simulator.py --port 8080 --delay 0.05
+  python dbus-fronius-smartmeter.py --url "http://127.0.0.1:8080/solar_api/v1/GetMeterRealtimeData.cgi"
+
+Answers every GET with a GetMeterRealtimeData response with slowly changing values.
+--delay simulates a slow inverter, --fail lets a share of the requests fail with HTTP 500.
+"""
+import argparse
+import json
+import logging
+import random
+import time
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2.x
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer  # Python 3.x
+
+
+class Meter:
+  def __init__(self):
+    self._power = [300.0, 200.0, 100.0]
+    self._consumed = 12345678.0 # Wh
+    self._produced = 2345678.0 # Wh
+    self._last = time.time()
+
+  def reading(self):
+    now = time.time()
+    elapsed, self._last = now - self._last, now
+    self._power = [p + random.uniform(-20, 20) for p in self._power]
+    total = sum(self._power)
+    if total > 0:
+      self._consumed += total * elapsed / 3600
+    else:
+      self._produced -= total * elapsed / 3600
+    data = {
+      'PowerReal_P_Sum': round(total, 1),
+      'EnergyReal_WAC_Sum_Consumed': int(self._consumed),
+      'EnergyReal_WAC_Sum_Produced': int(self._produced),
+    }
+    for phase, power in enumerate(self._power, 1):
+      voltage = 230 + random.uniform(-2, 2)
+      data['Voltage_AC_Phase_%d' % phase] = round(voltage, 1)
+      data['Current_AC_Phase_%d' % phase] = round(abs(power) / voltage, 3)
+      data['PowerReal_P_Phase_%d' % phase] = round(power, 1)
+    return {
+      'Body': {'Data': data},
+      'Head': {'Status': {'Code': 0, 'Reason': '', 'UserMessage': ''}, 'Timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+    }
+
+
+def make_handler(meter, delay, fail):
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the inverter
+
+    def do_GET(self):
+      time.sleep(delay)
+      if random.random() < fail:
+        self.send_error(500)
+        return
+      body = json.dumps(meter.reading()).encode('utf-8')
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      logging.debug("%s - %s" % (self.address_string(), format % args))
+
+  return Handler
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Fronius Solar API stand-in for dbus-fronius-smartmeter.py')
+  parser.add_argument('--port', type=int, default=8080)
+  parser.add_argument('--delay', type=float, default=0.0, help='seconds before each response')
+  parser.add_argument('--fail', type=float, default=0.0, help='share of requests answered with HTTP 500')
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.DEBUG)
+  server = HTTPServer(('127.0.0.1', args.port), make_handler(Meter(), args.delay, args.fail))
+  logging.info("serving GetMeterRealtimeData on http://127.0.0.1:%d/" % args.port)
+  server.serve_forever()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+Simulated Modbus TCP meter, to run dbus-modbus-meter.py and the modbus benchmark without a real meter:
+
+    python modbus_simulator.py --map sdm630 --port 5020
+    python dbus-modbus-meter.py --host 127.0.0.1 --port 5020 --map sdm630
+
+Serves the registers of a map in dbusmeter.sources.modbus.REGISTER_MAPS with slowly changing values,
+for every unit id. --delay simulates a slow meter or gateway.
+"""
+
+import argparse
+import logging
+import random
+import socketserver
+import struct
+import threading
+import time
+
+from dbusmeter.sources.modbus import REGISTER_MAPS, REGISTER_TYPES, REQUEST, RESPONSE_HEADER
+
+REGISTERS = 0x200  # size of the simulated register space
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+
+
+class SimulatedMeter:
+    ''' the registers of one meter, updated with new values on every read '''
+
+    def __init__(self, registermap):
+        regmap = REGISTER_MAPS[registermap]
+        self.function = regmap['function']
+        self._values = regmap['values']
+        self.registers = bytearray(2 * REGISTERS)
+        self._lock = threading.Lock()
+        self._power = [300.0, 200.0, 100.0]
+        self._imported = [4000.0, 3000.0, 2000.0]  # kWh
+        self._exported = [500.0, 600.0, 700.0]
+        self._last = time.time()
+
+    def update(self):
+        now = time.time()
+        elapsed, self._last = now - self._last, now
+        self._power = [p + random.uniform(-20, 20) for p in self._power]
+        values = {}
+        for i, power in enumerate(self._power):
+            phase = f'/Ac/L{i + 1}'
+            voltage = 230 + random.uniform(-2, 2)
+            if power > 0:
+                self._imported[i] += power * elapsed / 3600000
+            else:
+                self._exported[i] -= power * elapsed / 3600000
+            values[f'{phase}/Voltage'] = voltage
+            values[f'{phase}/Current'] = abs(power) / voltage
+            values[f'{phase}/Power'] = power
+            values[f'{phase}/Energy/Forward'] = self._imported[i]
+            values[f'{phase}/Energy/Reverse'] = self._exported[i]
+        values['/Ac/Power'] = sum(self._power)
+        values['/Ac/Energy/Forward'] = sum(self._imported)
+        values['/Ac/Energy/Reverse'] = sum(self._exported)
+
+        with self._lock:
+            for path, _, address, regtype, factor in self._values:
+                self._encode(address, regtype, values[path] / factor)
+
+    def _encode(self, address, regtype, value):
+        fields = REGISTER_TYPES[regtype][0]
+        if regtype == 'int32sw':
+            raw = int(round(value))
+            struct.pack_into('>Hh', self.registers, 2 * address, raw & 0xFFFF, raw >> 16)
+        elif fields == 'f':
+            struct.pack_into('>f', self.registers, 2 * address, value)
+        else:
+            struct.pack_into('>' + fields, self.registers, 2 * address, int(round(value)))
+
+    def read(self, address, count):
+        with self._lock:
+            return bytes(self.registers[2 * address:2 * (address + count)])
+
+
+def make_handler(meter, delay):
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                request = self._recv(REQUEST.size)
+                if request is None:
+                    return
+                transaction, _, _, unit, function, address, count = REQUEST.unpack(request)
+                time.sleep(delay)
+                if function != meter.function:
+                    self._exception(transaction, unit, function, ILLEGAL_FUNCTION)
+                elif count < 1 or count > 125 or address + count > REGISTERS:
+                    self._exception(transaction, unit, function, ILLEGAL_DATA_ADDRESS)
+                else:
+                    meter.update()
+                    data = meter.read(address, count)
+                    self.request.sendall(
+                        RESPONSE_HEADER.pack(transaction, 0, 3 + len(data), unit, function, len(data)) + data)
+
+        def _recv(self, size):
+            data = b''
+            while len(data) < size:
+                chunk = self.request.recv(size - len(data))
+                if not chunk:
+                    return None
+                data += chunk
+            return data
+
+        def _exception(self, transaction, unit, function, code):
+            self.request.sendall(RESPONSE_HEADER.pack(transaction, 0, 3, unit, function | 0x80, code))
+
+    return Handler
+
+
+class ThreadingServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def make_server(registermap='sdm630', host='127.0.0.1', port=5020, delay=0.0):
+    ''' returns the server, port 0 picks a free one (see server.server_address) '''
+    return ThreadingServer((host, port), make_handler(SimulatedMeter(registermap), delay))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated Modbus TCP meter')
+    parser.add_argument('--map', choices=sorted(REGISTER_MAPS), default='sdm630', help='register map')
+    parser.add_argument('--port', type=int, default=5020)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before each response')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(args.map, port=args.port, delay=args.delay)
+    logging.info(f"simulating a {args.map} on modbus://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,6 @@ rsync \
   --exclude '.DS_Store' \
   --exclude 'dbus-fronius-smartmeter.py' \
   --exclude '*.log' \
+  --exclude '*.snapshot' \
+  --exclude '*.bin' \
   ../venus.dbus-MqttToGridMeter/ root@venus.steinkopf.net:/data/mqtttogrid/
@@ -0,0 +1,3 @@
+'''
+Unit tests of the dbusmeter package and of vedbus.py, run with python -m unittest from the repository root.
+'''
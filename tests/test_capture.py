@@ -0,0 +1,63 @@
+import os
+import tempfile
+import time
+import unittest
+
+from dbusmeter.capture import PAYLOAD_SIZE, RECORD, CaptureReader, CaptureWriter
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.filename = os.path.join(self.directory.name, 'capture.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self):
+        reader = CaptureReader(self.filename)
+        try:
+            return reader.topics, list(reader)
+        finally:
+            reader.close()
+
+    def test_round_trip(self):
+        writer = CaptureWriter(self.filename, ['meter/power', 'meter/energy'])
+        writer.write(100.0, 'meter/power', b'123.4')
+        writer.write(100.5, 'other/topic', b'1')  # not registered: not captured
+        writer.write(101.0, 'meter/energy', b'x' * (PAYLOAD_SIZE + 5))
+        writer.close()
+        topics, records = self.read()
+        self.assertEqual(topics, ['meter/power', 'meter/energy'])
+        self.assertEqual(records, [(100.0, 'meter/power', b'123.4'), (101.0, 'meter/energy', b'x' * PAYLOAD_SIZE)])
+
+    def test_periodic_flush(self):
+        writer = CaptureWriter(self.filename, ['meter/power'], flush_seconds=0.01)
+        try:
+            writer.write(100.0, 'meter/power', b'1')
+            deadline = time.monotonic() + 2
+            while os.path.getsize(self.filename) == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)  # the header and the record are in the buffer until the flush
+            self.assertEqual(self.read()[1], [(100.0, 'meter/power', b'1')])  # written while still open
+        finally:
+            writer.close()
+
+    def test_cut_off_record_is_ignored(self):
+        writer = CaptureWriter(self.filename, ['meter/power'])
+        writer.write(100.0, 'meter/power', b'1')
+        writer.write(101.0, 'meter/power', b'2')
+        writer.close()
+        with open(self.filename, 'r+b') as f:
+            f.truncate(os.path.getsize(self.filename) - RECORD.size // 2)
+        self.assertEqual(self.read()[1], [(100.0, 'meter/power', b'1')])
+
+    def test_no_capture_file(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'not a capture file')
+        with self.assertRaises(ValueError):
+            CaptureReader(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
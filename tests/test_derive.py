@@ -0,0 +1,62 @@
+import unittest
+
+from dbusmeter.derive import NOMINAL_VOLTAGE, Derivations
+from dbusmeter.paths import METER_PATHS, PVINVERTER_PATHS
+
+
+class TestDerivations(unittest.TestCase):
+
+    def test_measured_path_is_not_derived(self):
+        derivations = Derivations(METER_PATHS, {'/Ac/L1/Power', '/Ac/L1/Voltage'})
+        self.assertNotIn('/Ac/L1/Voltage', derivations.inputs)
+        self.assertEqual(derivations.inputs['/Ac/L1/Current'], ('/Ac/L1/Power', '/Ac/L1/Voltage'))
+
+    def test_current_from_measured_else_nominal_voltage(self):
+        derivations = Derivations(METER_PATHS, {'/Ac/L1/Power', '/Ac/L2/Power', '/Ac/L3/Power', '/Ac/L1/Voltage'})
+        derived = derivations.update({'/Ac/L1/Power': 500.0, '/Ac/L2/Power': 230.0, '/Ac/L3/Power': 0.0,
+                                      '/Ac/L1/Voltage': 250.0})
+        self.assertEqual(derived['/Ac/L1/Current'], 2.0)
+        self.assertEqual(derived['/Ac/L2/Voltage'], NOMINAL_VOLTAGE)
+        self.assertEqual(derived['/Ac/L2/Current'], 1.0)
+        self.assertEqual(derived['/Ac/Power'], 730.0)
+
+    def test_only_changed_outputs(self):
+        derivations = Derivations(METER_PATHS, {'/Ac/L1/Power', '/Ac/L2/Power', '/Ac/L3/Power'})
+        derivations.update({'/Ac/L1/Power': 230.0, '/Ac/L2/Power': 0.0, '/Ac/L3/Power': 0.0})
+        # the nominal voltage is written once, L2 and L3 did not change
+        self.assertEqual(derivations.update({'/Ac/L1/Power': 460.0}), {'/Ac/L1/Current': 2.0, '/Ac/Power': 460.0})
+        self.assertEqual(derivations.update({'/Ac/L1/Power': 460.0}), {})
+
+    def test_reset_publishes_again(self):
+        derivations = Derivations(METER_PATHS, {'/Ac/Power'})
+        derivations.update({'/Ac/Power': 100.0})
+        derivations.reset()
+        self.assertEqual(derivations.update({'/Ac/Power': 100.0})['/Ac/L1/Voltage'], NOMINAL_VOLTAGE)
+
+    def test_single_phase(self):
+        # a pv inverter on L1 only: the totals are the sum of the phases that are there
+        derivations = Derivations(PVINVERTER_PATHS, {'/Ac/L1/Power', '/Ac/L1/Energy/Forward'})
+        self.assertEqual(derivations.inputs['/Ac/Power'], ('/Ac/L1/Power',))
+        self.assertEqual(derivations.inputs['/Ac/Energy/Forward'], ('/Ac/L1/Energy/Forward',))
+        self.assertNotIn('/Ac/L2/Energy/Forward', derivations.inputs)
+        self.assertNotIn('/Ac/L2/Current', derivations.inputs)
+        derived = derivations.update({'/Ac/L1/Power': 1500.0, '/Ac/L1/Energy/Forward': 12.5})
+        self.assertEqual(derived['/Ac/Power'], 1500.0)
+        self.assertEqual(derived['/Ac/Energy/Forward'], 12.5)
+        self.assertNotIn('/Ac/L2/Energy/Forward', derived)
+
+    def test_total_split_without_phase_power(self):
+        derivations = Derivations(METER_PATHS, {'/Ac/Power', '/Ac/Energy/Forward', '/Ac/Energy/Reverse'})
+        derived = derivations.update({'/Ac/Power': 100.0, '/Ac/Energy/Forward': 300.0, '/Ac/Energy/Reverse': 30.0})
+        self.assertEqual(derived['/Ac/L2/Energy/Forward'], 100.0)
+        self.assertEqual(derived['/Ac/L3/Energy/Reverse'], 10.0)
+        self.assertNotIn('/Ac/L1/Current', derived)
+
+    def test_restored_values_count_as_published(self):
+        derivations = Derivations(METER_PATHS, {'/Ac/Energy/Forward'})
+        derivations.restore({'/Ac/Energy/Forward': 300.0, '/Ac/L1/Energy/Forward': 100.0})
+        self.assertNotIn('/Ac/L1/Energy/Forward', derivations.update({'/Ac/Energy/Forward': 300.0}))
+
+
+if __name__ == '__main__':
+    unittest.main()
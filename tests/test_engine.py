@@ -0,0 +1,167 @@
+import os
+import tempfile
+import time
+import unittest
+
+try:
+    from dbusmeter.engine import (
+        CoalescingQueue, DeviceRegistry, LatencyHistogram, MeterService, PublishPolicy, message_counters)
+    from dbusmeter.paths import METER_PATHS
+    from tests.memorybus import MemoryBus
+except ImportError as e:  # dbusmeter needs dbus-python and PyGObject, as on the GX
+    raise unittest.SkipTest(f"dbusmeter not importable: {e}") from e
+
+
+class TestPublishPolicy(unittest.TestCase):
+
+    def test_deadband(self):
+        policy = PublishPolicy(deadband=5, maxinterval=60)
+        self.assertTrue(policy.offer(100.0, 0))
+        self.assertFalse(policy.offer(104.0, 1))
+        self.assertEqual((policy.held, policy.held_until), (104.0, 60))
+        self.assertTrue(policy.offer(106.0, 2))
+        self.assertIsNone(policy.held)
+
+    def test_reldeadband(self):
+        policy = PublishPolicy(deadband=1, reldeadband=0.1)
+        policy.offer(1000.0, 0)
+        self.assertFalse(policy.offer(1090.0, 1))
+        self.assertTrue(policy.offer(1110.0, 2))
+
+    def test_mininterval(self):
+        policy = PublishPolicy(mininterval=0.2)
+        self.assertTrue(policy.offer(100.0, 10.0))
+        self.assertFalse(policy.offer(200.0, 10.1))
+        self.assertEqual(policy.held_until, 10.2)
+        self.assertTrue(policy.offer(300.0, 10.25))
+
+    def test_maxinterval(self):
+        policy = PublishPolicy(deadband=5, maxinterval=60)
+        policy.offer(100.0, 0)
+        self.assertTrue(policy.offer(100.0, 60))
+
+    def test_invalid_and_reset(self):
+        policy = PublishPolicy(deadband=5, mininterval=10)
+        policy.offer(100.0, 0)
+        self.assertTrue(policy.offer(None, 1))
+        policy.reset()
+        self.assertTrue(policy.offer(101.0, 2))
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_window(self):
+        histogram = LatencyHistogram(buckets=(1, 10, 100))
+        for latency in [0.5] * 90 + [5.0] * 9 + [50.0]:
+            histogram.add(latency)
+        self.assertEqual(histogram.take_window(), (1.0, 10.0, 50.0))
+        self.assertEqual(histogram.take_window(), (None, None, None))
+        self.assertEqual(histogram.counts, [90, 9, 1, 0])
+
+    def test_percentile_capped_by_maximum(self):
+        histogram = LatencyHistogram(buckets=(1, 10, 100))
+        histogram.add(3.0)
+        histogram.add(1000.0)
+        self.assertEqual(histogram.take_window(), (10.0, 1000.0, 1000.0))
+
+
+class TestCoalescingQueue(unittest.TestCase):
+
+    def test_newer_value_replaces_older(self):
+        batches = []
+        queue = CoalescingQueue(batches.append, coalesce_ms=None)
+        dropped = message_counters.dropped
+        queue.put_many(((('grid', '/Ac/Power'), 1), (('grid', '/Ac/L1/Power'), 2)))
+        queue.put(('grid', '/Ac/Power'), 3)
+        queue.drain()
+        queue.drain()
+        self.assertEqual(batches, [{('grid', '/Ac/Power'): 3, ('grid', '/Ac/L1/Power'): 2}])
+        self.assertEqual(message_counters.dropped, dropped + 1)
+
+
+# without the publish policies, every value is published right away
+PATHS = {
+    path: {key: value for key, value in settings.items() if key != 'policy'} for path, settings in METER_PATHS.items()}
+CHANNELS = {'/Ac/Power': 'power', '/Ac/Energy/Forward': 'forward', '/Ac/Energy/Reverse': 'reverse'}
+
+
+def meter_service(role='grid', on_stale=None, snapshot=None):
+    return MeterService('com.victronenergy.grid.test', 30, PATHS, 'Test meter', 'test', role=role, bus=MemoryBus(),
+                        channels=CHANNELS, on_stale=on_stale, snapshot=snapshot)
+
+
+def feed(service, values):
+    now = time.monotonic()
+    service.update(values, received={path: now for path in values})
+
+
+class TestDegradeAndResume(unittest.TestCase):
+    # pylint: disable=protected-access
+
+    def test_grid_invalidates_and_resumes(self):
+        calls = []
+        service = meter_service(on_stale=lambda: calls.append(1))
+        feed(service, {'/Ac/Power': 500.0, '/Ac/Energy/Forward': 100.0})
+        exported = service._vedbusservice
+
+        service._last_update = time.time() - 11
+        service._sign_of_life()
+        service._sign_of_life()  # still stale, the retry backs off
+        self.assertTrue(service.stale)
+        self.assertEqual(calls, [1])
+        self.assertEqual(exported['/Connected'], 0)
+        self.assertEqual((exported['/Ac/Power'], exported['/Ac/Energy/Forward']), (None, None))
+
+        feed(service, {'/Ac/Power': 400.0})
+        self.assertFalse(service.stale)
+        self.assertEqual((exported['/Connected'], exported['/Ac/Power']), (1, 400.0))
+        self.assertEqual(exported['/Mgmt/Stats/Recoveries'], 1)
+
+    def test_pvinverter_keeps_its_values(self):
+        service = meter_service(role='pvinverter')
+        feed(service, {'/Ac/Power': 1500.0})
+        service._last_update = time.time() - 11
+        service._sign_of_life()
+        exported = service._vedbusservice
+        self.assertEqual((exported['/Connected'], exported['/Ac/Power']), (0, 1500.0))
+
+    def test_source_reconnects_when_all_devices_are_stale(self):
+        devices = {
+            'grid': {'servicename': 'com.victronenergy.grid.test', 'deviceinstance': 30, 'deviceclass': 'grid',
+                     'productname': 'Grid', 'connection': 'test'},
+            'pv': {'servicename': 'com.victronenergy.pvinverter.test', 'deviceinstance': 31,
+                   'deviceclass': 'pvinverter', 'productname': 'PV', 'connection': 'test'},
+        }
+        calls = []
+        registry = DeviceRegistry(devices, {('grid', '/Ac/Power'): 'grid', ('pv', '/Ac/Power'): 'pv'},
+                                  bus_factory=MemoryBus, on_stale=lambda: calls.append(1))
+        now = time.monotonic()
+        registry.update({('grid', '/Ac/Power'): (500.0, now), ('pv', '/Ac/Power'): (1500.0, now)})
+        for device in ('pv', 'grid'):
+            registry[device]._last_update = time.time() - 11
+
+        registry['pv']._sign_of_life()  # silent at night, the grid meter still gets data
+        self.assertEqual(calls, [])
+        registry['grid']._sign_of_life()
+        self.assertEqual(calls, [1])
+
+
+class TestSnapshotAfterOutage(unittest.TestCase):
+    # pylint: disable=protected-access
+
+    def test_degrade_keeps_the_latest_counters(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'grid.snapshot')
+            service = meter_service(snapshot=filename)
+            feed(service, {'/Ac/Energy/Forward': 100.0})
+            service._save_snapshot()  # the timer
+            feed(service, {'/Ac/Energy/Forward': 101.0})
+            service.update(gridloss=True)
+            service._save_snapshot()  # at exit, all counters are invalid now
+
+            restarted = meter_service(snapshot=filename)
+            self.assertEqual(restarted._vedbusservice['/Ac/Energy/Forward'], 101.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+
+from dbusmeter.integrator import MAX_GAP, EnergyIntegrator, trapezoid
+
+PHASES = [(f'/Ac/L{i}/Power', f'/Ac/L{i}/Energy/Forward', f'/Ac/L{i}/Energy/Reverse') for i in range(1, 4)]
+TOTALS = ('/Ac/Energy/Forward', '/Ac/Energy/Reverse')
+
+
+def powers(p1, p2, p3):
+    return {'/Ac/L1/Power': p1, '/Ac/L2/Power': p2, '/Ac/L3/Power': p3}
+
+
+class TestTrapezoid(unittest.TestCase):
+
+    def test_same_sign(self):
+        self.assertEqual(trapezoid(1000, 1000, 3600), (1.0, 0.0))
+        self.assertEqual(trapezoid(-500, -1500, 3600), (0.0, 1.0))
+
+    def test_zero_crossing(self):
+        # 3000 W down to -1000 W in an hour: crosses zero after 45 minutes
+        imported, exported = trapezoid(3000, -1000, 3600)
+        self.assertAlmostEqual(imported, 1.125)
+        self.assertAlmostEqual(exported, 0.125)
+        imported, exported = trapezoid(-1000, 3000, 3600)
+        self.assertAlmostEqual(imported, 1.125)
+        self.assertAlmostEqual(exported, 0.125)
+
+
+class TestEnergyIntegrator(unittest.TestCase):
+
+    def setUp(self):
+        self.integrator = EnergyIntegrator(PHASES, TOTALS, measured=set(TOTALS))
+        self.t = 1000.0
+        self.published = {}
+
+    def add(self, values, seconds=10):
+        self.t += seconds
+        changed = self.integrator.add(values, {path: self.t for path in values})
+        self.published.update(changed)
+        return changed
+
+    def run_hour(self, p1, p2, p3):
+        for _ in range(360):
+            changed = self.add(powers(p1, p2, p3))
+        return changed
+
+    def test_first_total_split_evenly(self):
+        changed = self.add(dict(powers(0, 0, 0), **{TOTALS[0]: 300.0, TOTALS[1]: 30.0}))
+        self.assertEqual(changed['/Ac/L2/Energy/Forward'], 100.0)
+        self.assertEqual(changed['/Ac/L3/Energy/Reverse'], 10.0)
+
+    def test_integrates_both_directions(self):
+        self.add(dict(powers(1000, 2000, -500), **{TOTALS[0]: 300.0, TOTALS[1]: 30.0}))
+        self.run_hour(1000, 2000, -500)
+        self.assertEqual(self.published['/Ac/L1/Energy/Forward'], 101.0)
+        self.assertEqual(self.published['/Ac/L2/Energy/Forward'], 102.0)
+        self.assertEqual(self.published['/Ac/L3/Energy/Forward'], 100.0)
+        self.assertEqual(self.published['/Ac/L3/Energy/Reverse'], 10.5)
+
+    def test_resync_distributes_by_share(self):
+        self.add(dict(powers(1000, 2000, 0), **{TOTALS[0]: 300.0, TOTALS[1]: 30.0}))
+        self.run_hour(1000, 2000, 0)
+        # the meter counted 3.3 kWh where 3 were integrated: L2 gets twice the share of L1
+        changed = self.add({TOTALS[0]: 303.3, TOTALS[1]: 30.0}, seconds=1)
+        self.assertEqual(changed['/Ac/L1/Energy/Forward'], 101.1)
+        self.assertEqual(changed['/Ac/L2/Energy/Forward'], 102.2)
+        self.assertNotIn('/Ac/L3/Energy/Forward', changed)
+
+    def test_restore_then_total_split_evenly(self):
+        self.integrator.restore({path: 100.0 for phase in PHASES for path in phase[1:]})
+        self.add(powers(1000, 0, 0))
+        self.add(powers(1000, 0, 0))
+        # 30 kWh since the snapshot, the phases only saw the last 10 seconds of L1
+        changed = self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 330.0}), seconds=1)
+        self.assertEqual([changed[phase[1]] for phase in PHASES], [110.0, 110.0, 110.0])
+
+    def test_total_after_a_gap_split_evenly(self):
+        self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 300.0, TOTALS[1]: 30.0}))
+        self.add(powers(1000, 0, 0))
+        self.add(powers(1000, 0, 0), seconds=MAX_GAP + 1)
+        changed = self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 303.0}), seconds=1)
+        self.assertEqual([changed[phase[1]] for phase in PHASES], [101.0, 101.0, 101.0])
+
+    def test_never_decreases(self):
+        self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 300.0, TOTALS[1]: 30.0}))
+        self.run_hour(1000, 0, 0)
+        # the meter counted less than was integrated: the counter holds until the meter has caught up
+        self.assertNotIn('/Ac/L1/Energy/Forward', self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 300.5}), seconds=1))
+        changed = self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 301.5}), seconds=1)
+        self.assertEqual(changed['/Ac/L1/Energy/Forward'], 101.5)
+
+    def test_gap_is_not_integrated(self):
+        self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 300.0, TOTALS[1]: 30.0}))
+        self.assertEqual(self.add(powers(3600000, 0, 0), seconds=MAX_GAP + 1), {})
+
+    def test_reset_skips_the_outage_and_republishes(self):
+        self.add(dict(powers(1000, 0, 0), **{TOTALS[0]: 300.0, TOTALS[1]: 30.0}))
+        self.integrator.reset()
+        changed = self.add(powers(1000, 0, 0))
+        self.assertEqual(len(changed), 6)
+        self.assertEqual(changed['/Ac/L1/Energy/Forward'], 100.0)
+
+    def test_restore_without_measured_total(self):
+        integrator = EnergyIntegrator(PHASES[:1], TOTALS, measured=set(), max_gap=3600)
+        integrator.restore({'/Ac/L1/Energy/Forward': 12.0})
+        integrator.add(powers(3600, 0, 0), {'/Ac/L1/Power': 0.0})
+        changed = integrator.add(powers(3600, 0, 0), {'/Ac/L1/Power': 1000.0})
+        self.assertEqual(changed, {'/Ac/L1/Energy/Forward': 13.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from dbusmeter.snapshot import Snapshot
+
+PATHS = ('/Ac/Energy/Forward', '/Ac/Energy/Reverse', '/Ac/L1/Energy/Forward')
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.filename = os.path.join(self.directory.name, 'grid.snapshot')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.assertTrue(Snapshot(self.filename, PATHS, 'grid/31').save(
+            {'/Ac/Energy/Forward': 1234.5, '/Ac/Energy/Reverse': 0.0, '/Ac/L1/Energy/Forward': None}))
+        self.assertEqual(Snapshot(self.filename, PATHS, 'grid/31').load(),
+                         {'/Ac/Energy/Forward': 1234.5, '/Ac/Energy/Reverse': 0.0})
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+    def test_missing_file(self):
+        self.assertEqual(Snapshot(self.filename, PATHS).load(), {})
+
+    def test_other_identity_or_paths(self):
+        Snapshot(self.filename, PATHS, 'grid/31').save({'/Ac/Energy/Forward': 1.0})
+        self.assertEqual(Snapshot(self.filename, PATHS, 'grid/32').load(), {})
+        self.assertEqual(Snapshot(self.filename, PATHS[:2] + ('/Ac/L2/Energy/Forward',), 'grid/31').load(), {})
+
+    def test_damaged_file(self):
+        Snapshot(self.filename, PATHS).save({'/Ac/Energy/Forward': 1.0})
+        with open(self.filename, 'r+b') as f:
+            f.truncate(os.path.getsize(self.filename) - 1)
+        self.assertEqual(Snapshot(self.filename, PATHS).load(), {})
+
+    def test_invalid_value_keeps_the_saved_one(self):
+        snapshot = Snapshot(self.filename, PATHS)
+        snapshot.save({'/Ac/Energy/Forward': 1.0, '/Ac/Energy/Reverse': 2.0})
+        # the meter went offline: nothing changed, nothing is written
+        self.assertFalse(snapshot.save({'/Ac/Energy/Forward': None, '/Ac/Energy/Reverse': None}))
+        self.assertTrue(snapshot.save({'/Ac/Energy/Forward': 1.5, '/Ac/Energy/Reverse': None}))
+        self.assertEqual(Snapshot(self.filename, PATHS).load(), {'/Ac/Energy/Forward': 1.5, '/Ac/Energy/Reverse': 2.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
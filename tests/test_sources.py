@@ -0,0 +1,74 @@
+import struct
+import unittest
+
+from dbusmeter.sources import BACKOFF_INTERVAL, PollScheduler
+from dbusmeter.sources.modbus import REGISTER_MAPS, plan_blocks
+
+
+class TestPollScheduler(unittest.TestCase):
+
+    def test_steady_power_slows_down(self):
+        scheduler = PollScheduler(min_interval=0.2, max_interval=5.0)
+        delays = [scheduler.next_delay(0.0, 100.0) for _ in range(20)]
+        self.assertEqual(delays[-1], 5.0)
+        self.assertTrue(all(a <= b for a, b in zip(delays, delays[1:])))
+
+    def test_power_step_speeds_up(self):
+        scheduler = PollScheduler(min_interval=0.2, max_interval=5.0)
+        for _ in range(20):
+            scheduler.next_delay(0.0, 100.0)
+        self.assertEqual(scheduler.next_delay(0.0, 1000.0), 0.2)
+
+    def test_response_time_counts(self):
+        scheduler = PollScheduler(min_interval=0.2, max_interval=5.0)
+        scheduler.next_delay(0.0, 100.0)
+        self.assertAlmostEqual(scheduler.next_delay(0.1, 1000.0), 0.1)  # 0.2 s from start to start
+        for _ in range(20):
+            scheduler.next_delay(2.0, 100.0)
+        # a slow device is busy answering at most a quarter of the time
+        self.assertAlmostEqual(scheduler.interval, 8.0, delta=0.5)
+
+    def test_failures_back_off(self):
+        scheduler = PollScheduler(min_interval=0.2, max_interval=5.0)
+        delays = [scheduler.next_delay(0.0) for _ in range(12)]
+        self.assertEqual(delays[:3], [0.4, 0.8, 1.6])
+        self.assertEqual(delays[-1], BACKOFF_INTERVAL)
+        scheduler.next_delay(0.0, 100.0)
+        self.assertEqual((scheduler.failures, scheduler.interval), (0, 5.0))
+
+
+class TestModbusBlocks(unittest.TestCase):
+
+    def test_register_maps(self):
+        self.assertEqual(len(plan_blocks(REGISTER_MAPS['sdm630']['values'])), 2)
+        self.assertEqual(len(plan_blocks(REGISTER_MAPS['em24']['values'])), 1)
+
+    def test_gap_and_size_limits(self):
+        values = [('/A', 'a', 0, 'uint16', 1), ('/B', 'b', 10, 'uint16', 1), ('/C', 'c', 100, 'uint16', 1)]
+        blocks = plan_blocks(values, max_gap=20)
+        self.assertEqual([(block.address, block.count) for block in blocks], [(0, 11), (100, 1)])
+        blocks = plan_blocks(values, max_block=5)
+        self.assertEqual(len(blocks), 3)
+
+    def test_decode(self):
+        values = [
+            ('/Ac/L1/Voltage', 'v', 0, 'float32', 1),
+            ('/Ac/Power', 'p', 4, 'int16', 1),
+            ('/Ac/Energy/Forward', 'e', 5, 'int32sw', 0.1),
+            ('/Ac/L1/Current', 'a', 7, 'uint32', 0.001),
+        ]
+        block, = plan_blocks(values)
+        self.assertEqual((block.address, block.count), (0, 9))
+        energy = 123456
+        data = (struct.pack('>f', 230.5) + b'\0' * 4 + struct.pack('>h', -1500)
+                + struct.pack('>Hh', energy & 0xFFFF, energy >> 16) + struct.pack('>I', 5250))
+        decoded = {}
+        block.decode(data, decoded)
+        self.assertEqual(decoded['/Ac/L1/Voltage'], 230.5)
+        self.assertEqual(decoded['/Ac/Power'], -1500)
+        self.assertAlmostEqual(decoded['/Ac/Energy/Forward'], 12345.6)
+        self.assertAlmostEqual(decoded['/Ac/L1/Current'], 5.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+
+try:
+    import dbus.exceptions
+    from tests.memorybus import MemoryBus
+    from ve_utils import wrap_dbus_value
+    from vedbus import VeDbusBulkImport, VeDbusService
+except ImportError as e:  # needs dbus-python, as on the GX
+    raise unittest.SkipTest(f"vedbus not importable: {e}") from e
+
+
+class TestVeDbusService(unittest.TestCase):
+
+    def setUp(self):
+        self.service = VeDbusService('com.victronenergy.test', bus=MemoryBus())
+        self.service.add_paths({
+            '/Ac/Power': {'value': 100.0, 'textformat': '{:.0f}W'},
+            '/Ac/L1/Power': {'value': 40.0, 'textformat': '{:.0f}W'},
+            '/Ac/L2/Power': {'value': 60.0, 'textformat': '{:.0f}W'},
+            '/Serial': {'value': 'abc'},
+        })
+
+    def test_node_values(self):
+        node = self.service._dbusnodes['/Ac']  # pylint: disable=protected-access
+        self.assertEqual(node.GetValue(), {'Power': 100.0, 'L1/Power': 40.0, 'L2/Power': 60.0})
+        self.assertEqual(node.GetText(), {'Power': '100W', 'L1/Power': '40W', 'L2/Power': '60W'})
+        root = self.service._dbusnodes['/']  # pylint: disable=protected-access
+        self.assertEqual(set(root.GetValue()), {'Ac/Power', 'Ac/L1/Power', 'Ac/L2/Power', 'Serial'})
+
+    def test_get_items_follows_changes(self):
+        root = self.service._dbusnodes['/']  # pylint: disable=protected-access
+        with self.service as s:
+            s['/Ac/L1/Power'] = 45.0
+        self.assertEqual(root.GetItems()['/Ac/L1/Power'], {'Value': 45.0, 'Text': '45W'})
+
+    def test_add_and_remove(self):
+        self.service.add_path('/Ac/L3/Power', 0.0, textformat='{:.0f}W')
+        nodes = self.service._dbusnodes  # pylint: disable=protected-access
+        self.assertIn('L3/Power', nodes['/Ac'].GetValue())
+        self.assertIn('/Ac/L3', nodes)
+
+        del self.service['/Ac/L3/Power']
+        self.assertNotIn('/Ac/L3', nodes)  # the node left empty is removed
+        self.assertNotIn('L3/Power', nodes['/Ac'].GetValue())
+        self.assertNotIn('/Ac/L3/Power', nodes['/'].GetItems())
+
+        for path in ('/Ac/Power', '/Ac/L1/Power', '/Ac/L2/Power'):
+            del self.service[path]
+        self.assertNotIn('/Ac', nodes)
+        self.assertNotIn('/Ac/L1', nodes)
+        self.assertEqual(set(nodes['/'].GetItems()), {'/Serial'})
+
+    def test_value_type(self):
+        self.service.add_path('/Flag', False)
+        self.service.add_path('/Count', 0, valuetype=int)
+        self.service['/Flag'] = 2
+        self.service['/Count'] = 3.7
+        self.service['/Ac/Power'] = 7
+        self.assertEqual(self.service['/Flag'], 2)  # bool and str initial values do not pin the type
+        self.assertEqual(self.service['/Count'], 3)
+        self.assertIs(type(self.service['/Ac/Power']), float)
+
+
+    def test_text_callback_is_not_memoized(self):
+        unit = ['W']
+        self.service.add_path('/Ac/L3/Power', 1.0, gettextcallback=lambda path, value: f'{value:.0f}{unit[0]}')
+        item = self.service._dbusobjects['/Ac/L3/Power']  # pylint: disable=protected-access
+        self.assertEqual(item.GetText(), '1W')
+        unit[0] = ' W'  # e.g. a setting the callback reads
+        self.assertEqual(item.GetText(), '1 W')
+
+class Match:
+    ''' a signal match or name owner watch of the RemoteBus '''
+
+    def remove(self):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class RemoteBus:
+    ''' the client side of a bus with one remote service: GetItems, the ItemsChanged and PropertiesChanged signals '''
+
+    def __init__(self, items):
+        self.items = items
+        self.items_changed = self.properties_changed = self.owner_changed = None
+
+    def get_object(self, service, path, introspect=True):  # pylint: disable=unused-argument
+        return self
+
+    def GetItems(self):  # pylint: disable=invalid-name
+        if self.items is None:
+            raise dbus.exceptions.DBusException('org.freedesktop.DBus.Error.ServiceUnknown')
+        return self.items
+
+    def connect_to_signal(self, signal, handler):  # pylint: disable=unused-argument
+        self.items_changed = handler
+        return Match()
+
+    def add_signal_receiver(self, handler, **kwargs):  # pylint: disable=unused-argument
+        self.properties_changed = handler
+        return Match()
+
+    def watch_name_owner(self, service, handler):  # pylint: disable=unused-argument
+        self.owner_changed = handler
+        return Match()
+
+
+class TestBulkImport(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = RemoteBus({
+            '/Soc': {'Value': wrap_dbus_value(80.0), 'Text': '80%'},
+            '/Dc/0/Voltage': {'Value': wrap_dbus_value(52.1), 'Text': '52.1V'},
+            '/Dc/0/Current': {'Value': wrap_dbus_value(None), 'Text': '---'},
+        })
+        self.battery = VeDbusBulkImport(self.bus, 'com.victronenergy.battery.test')
+        self.changes = []
+        self.battery.add_callback('/Soc', lambda service, path, changes: self.changes.append((path, changes)))
+        self.battery.add_callback('/Dc/', lambda service, path, changes: self.changes.append((path, changes)))
+
+    def test_initial_read(self):
+        self.assertEqual(self.battery.get_value('/Soc'), 80.0)
+        self.assertIsNone(self.battery.get_value('/Dc/0/Current'))
+        self.assertTrue(self.battery.exists('/Dc/0/Current'))
+        self.assertFalse(self.battery.exists('/Dc/1/Voltage'))
+        self.assertEqual(set(self.battery.paths()), set(self.bus.items))
+
+    def test_items_changed(self):
+        self.bus.items_changed({
+            '/Soc': {'Value': wrap_dbus_value(81.0), 'Text': '81%'},
+            '/Dc/0/Voltage': {'Value': wrap_dbus_value(52.1), 'Text': '52.1V'},  # unchanged, no callback
+            '/Dc/0/Current': {'Value': wrap_dbus_value(-3.5)},
+        })
+        self.assertEqual(self.changes, [
+            ('/Soc', {'Value': 81.0, 'Text': '81%'}), ('/Dc/0/Current', {'Value': -3.5, 'Text': '-3.5'})])
+        self.assertEqual(self.battery.get_value('/Soc'), 81.0)
+
+    def test_properties_changed(self):
+        self.bus.properties_changed({'Value': wrap_dbus_value(79.0), 'Text': '79%'}, path='/Soc')
+        self.assertEqual(self.changes, [('/Soc', {'Value': 79.0, 'Text': '79%'})])
+
+    def test_refresh_drops_removed_paths(self):
+        del self.bus.items['/Dc/0/Voltage']
+        self.assertTrue(self.battery.refresh())
+        self.assertEqual(self.changes, [('/Dc/0/Voltage', {'Value': None, 'Text': '---'})])
+        self.assertFalse(self.battery.exists('/Dc/0/Voltage'))
+
+    def test_service_gone_and_back(self):
+        self.bus.owner_changed(':1.5')  # the first owner, already read by the constructor
+        self.bus.owner_changed('')
+        self.assertIsNone(self.battery.get_value('/Soc'))
+        self.assertEqual(self.changes[0], ('/Soc', {'Value': None, 'Text': '---'}))
+
+        self.bus.owner_changed(':1.6')
+        self.assertEqual(self.battery.get_value('/Soc'), 80.0)
+        self.bus.items = None
+        self.assertFalse(self.battery.refresh())
+        self.assertIsNone(self.battery.get_value('/Dc/0/Voltage'))
+
+
+if __name__ == '__main__':
+    unittest.main()
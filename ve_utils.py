@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import sys
 from traceback import print_exc
+from functools import partial
 from os import _exit as os_exit
 from os import statvfs
 from subprocess import check_output, CalledProcessError
@@ -232,6 +233,27 @@ def wrap_dbus_value(value):
 	return value
 
 
+def _wrap_int(value):
+	try:
+		return dbus.Int32(value, variant_level=1)
+	except OverflowError:
+		return dbus.Int64(value, variant_level=1)
+
+_value_wrappers = {
+	float: partial(dbus.Double, variant_level=1),
+	bool: partial(dbus.Boolean, variant_level=1),
+	int: _wrap_int,
+	str: partial(dbus.String, variant_level=1),
+}
+
+
+# Returns the function that wraps values of valuetype (float, bool, int or str) the way wrap_dbus_value does,
+# but without its chain of isinstance checks, mostly straight into the dbus type. The values passed must be
+# of valuetype and not None. For other types wrap_dbus_value itself is returned.
+def dbus_value_wrapper(valuetype):
+	return _value_wrappers.get(valuetype, wrap_dbus_value)
+
+
 dbus_int_types = (dbus.Int32, dbus.UInt32, dbus.Byte, dbus.Int16, dbus.UInt16, dbus.UInt32, dbus.Int64, dbus.UInt64)
 
 
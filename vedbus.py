@@ -7,10 +7,11 @@ import traceback
 import os
 import weakref
 from collections import defaultdict
-from ve_utils import wrap_dbus_value, unwrap_dbus_value
+from ve_utils import wrap_dbus_value, unwrap_dbus_value, dbus_value_wrapper, VEDBUS_INVALID
 
 # vedbus contains three classes:
 # VeDbusItemImport -> use this to read data from the dbus, ie import
+# VeDbusBulkImport -> use this to read all data of a service at once, with one GetItems call
 # VeDbusItemExport -> use this to export data to the dbus (one value)
 # VeDbusService -> use that to create a service and export several values to the dbus
 
@@ -58,12 +59,27 @@ from ve_utils import wrap_dbus_value, unwrap_dbus_value
 
 # Export ourselves as a D-Bus service.
 class VeDbusService(object):
-	def __init__(self, servicename, bus=None):
+	## Constructor
+	# @param itemsignals	when False (default), a batched update (with service as s: ...) only sends one
+	#						ItemsChanged signal on the root. Set to True to additionally send a PropertiesChanged
+	#						signal for every changed item, for consumers that only track single paths.
+	# @param lazytext		when True, the signals only carry the new Value, and the Text of an item is only
+	#						formatted when asked for with GetText, GetItems or GetText on a tree node.
+	def __init__(self, servicename, bus=None, itemsignals=False, lazytext=False):
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
 		self._dbusnodes = {}
+		# dict containing, for each tree node, the VeDbusItemExport objects below it, keyed by their
+		# path relative to the node. Answers GetValue and GetText on a node without scanning all objects.
+		self._subtrees = {'/': {}}
+		# dict containing the GetItems reply, path -> {'Value': wrapped value, 'Text': text}. Kept up to date
+		# with the changes the objects compute anyway for their signals, so GetItems costs nothing per path.
+		self._itemsnapshot = {}
+		self._textdirty = set()  # paths whose snapshot has no Text yet, with lazytext
+		self._lazytext = lazytext
 		self._ratelimiters = []
 		self._dbusname = None
+		self._itemsignals = itemsignals
 
 		# dict containing the onchange callbacks, for each object. Object path is the key
 		self._onchangecallbacks = {}
@@ -98,23 +114,56 @@ class VeDbusService(object):
 	# @param callbackonchange	function that will be called when this value is changed. First parameter will
 	#							be the path of the object, second the new value. This callback should return
 	#							True to accept the change, False to reject it.
+	# @param valuetype	float, int, bool or str: every value of the path is converted to this type, so its
+	#					D-Bus type never changes. When None, a float initial value sets it. Other types are only
+	#					pinned when passed explicitly: an int 0 is often a placeholder for a float, and a bool or
+	#					str initial value does not mean that the path never takes a number.
+	# @param textformat	format string for the text of the value, e.g. '{:.0f}W', used instead of
+	#					gettextcallback. Faster, as it is applied without a Python callback.
 	def add_path(self, path, value, description="", writeable=False,
-					onchangecallback=None, gettextcallback=None, valuetype=None):
-
+					onchangecallback=None, gettextcallback=None, valuetype=None, textformat=None):
+		self._add_item(path, value, description, writeable, onchangecallback, gettextcallback, valuetype, textformat)
+		self._add_nodes((path,))
+		logging.debug('added %s with start value %s. Writeable is %s', path, value, writeable)
+
+	## Adds many paths in one pass, e.g. all paths of a service at startup. The tree nodes above them are
+	# created once, after all items.
+	# @param paths		dict path -> dict with the 'value' and other keyword arguments of add_path
+	# @param defaults	keyword arguments of add_path for all paths that do not set them, e.g. writeable=True
+	def add_paths(self, paths, **defaults):
+		for path, settings in paths.items():
+			self._add_item(path, **dict(defaults, **settings))
+		self._add_nodes(paths)
+		logging.debug('added %d paths', len(paths))
+
+	def _add_item(self, path, value, description="", writeable=False,
+					onchangecallback=None, gettextcallback=None, valuetype=None, textformat=None):
 		if onchangecallback is not None:
 			self._onchangecallbacks[path] = onchangecallback
 
+		if valuetype is None and type(value) is float:
+			valuetype = float
+
 		item = VeDbusItemExport(
 				self._dbusconn, path, value, description, writeable,
-				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype)
+				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype,
+				changedcallback=self._item_changed, textformat=textformat, lazytext=self._lazytext)
 
-		spl = path.split('/')
-		for i in range(2, len(spl)):
-			subPath = '/'.join(spl[:i])
-			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
-				self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
 		self._dbusobjects[path] = item
-		logging.debug('added %s with start value %s. Writeable is %s' % (path, value, writeable))
+		for nodePath, relPath in self._node_paths(path):
+			self._subtrees.setdefault(nodePath, {})[relPath] = item
+		self._itemsnapshot[path] = {'Value': item.GetValue(), 'Text': item.GetText()}
+
+	# Exports the tree nodes above the paths that are not exported yet. Nodes are exported top down, so when the
+	# parent of a path is there, all nodes above it are.
+	def _add_nodes(self, paths):
+		for path in paths:
+			parent = path[:path.rfind('/')]
+			if not parent or parent in self._dbusnodes:
+				continue
+			for nodePath, _ in self._node_paths(path):
+				if nodePath not in self._dbusnodes and nodePath not in self._dbusobjects:
+					self._dbusnodes[nodePath] = VeDbusTreeExport(self._dbusconn, nodePath, self)
 
 	# Add the mandatory paths, as per victron dbus api doc
 	def add_mandatory_paths(self, processname, processversion, connection,
@@ -139,16 +188,50 @@ class VeDbusService(object):
 
 		return self._onchangecallbacks[path](path, newvalue)
 
+	# The tree nodes above path, each with path relative to it: '/Ac/L1/Power' gives ('/', 'Ac/L1/Power'),
+	# ('/Ac', 'L1/Power') and ('/Ac/L1', 'Power').
+	@staticmethod
+	def _node_paths(path):
+		yield '/', path[1:]
+		i = path.find('/', 1)
+		while i != -1:
+			yield path[:i], path[i + 1:]
+			i = path.find('/', i + 1)
+
+	# Returns a dict with the objects below the tree node at path, keyed by their path relative to it.
+	def _subtree(self, path):
+		return self._subtrees.get(path, {})
+
+	# Callback function that is called from the VeDbusItemExport objects with the changes of a new value
+	def _item_changed(self, path, changes):
+		self._itemsnapshot[path] = changes
+		if self._lazytext:
+			self._textdirty.add(path)
+
+	# Returns the GetItems reply, with the Text of the items changed since the last call formatted now
+	def _get_items(self):
+		if self._textdirty:
+			for path in self._textdirty:
+				self._itemsnapshot[path] = {
+					'Value': self._itemsnapshot[path]['Value'], 'Text': self._dbusobjects[path].GetText()}
+			self._textdirty.clear()
+		return self._itemsnapshot
+
+	# Removes path from the subtree of each node above it, and the nodes left empty. O(depth).
 	def _item_deleted(self, path):
 		self._dbusobjects.pop(path)
-		for np in list(self._dbusnodes.keys()):
-			if np != '/':
-				for ip in self._dbusobjects:
-					if ip.startswith(np + '/'):
-						break
-				else:
-					self._dbusnodes[np].__del__()
-					self._dbusnodes.pop(np)
+		self._itemsnapshot.pop(path, None)
+		self._textdirty.discard(path)
+		for nodePath, relPath in self._node_paths(path):
+			subtree = self._subtrees.get(nodePath)
+			if subtree is None:
+				continue
+			subtree.pop(relPath, None)
+			if not subtree and nodePath != '/':
+				del self._subtrees[nodePath]
+				node = self._dbusnodes.pop(nodePath, None)
+				if node is not None:
+					node.__del__()
 
 	def __getitem__(self, path):
 		return self._dbusobjects[path].local_get_value()
@@ -190,6 +273,9 @@ class ServiceContext(object):
 	def flush(self):
 		if self.changes:
 			self.parent._dbusnodes['/'].ItemsChanged(self.changes)
+			if self.parent._itemsignals:
+				for path, c in self.changes.items():
+					self.parent._dbusobjects[path].PropertiesChanged(c)
 
 class TrackerDict(defaultdict):
 	""" Same as defaultdict, but passes the key to default_factory. """
@@ -389,6 +475,163 @@ class VeDbusItemImport(object):
 					os._exit(1)  # sys.exit() is not used, since that also throws an exception
 
 
+"""
+Bulk import:
+	VeDbusItemImport costs one GetValue call and one PropertiesChanged match per path. VeDbusBulkImport
+	reads all items of a service with one GetItems call on its root, and keeps them up to date with one
+	ItemsChanged match, the signal that VeDbusService sends for every batch of changes. Values set outside
+	a batch are only sent with PropertiesChanged on their own path, these are received with one match on
+	all paths of the service. A value that arrives with both signals is only reported once. The values are
+	kept unwrapped in one dict, the texts are not kept: get_text() asks the service.
+
+	The owner of the service name is watched: when the service leaves the bus all values become None,
+	when it (re)appears they are read again with GetItems. Callbacks are called with the same arguments
+	as the eventCallback of VeDbusItemImport, for one path or for all paths below a prefix.
+"""
+class VeDbusBulkImport(object):
+	## Constructor
+	# @param bus			the bus-object (SESSION or SYSTEM).
+	# @param serviceName	the dbus-service-name (string), for example 'com.victronenergy.battery.ttyO1'
+	# @param eventCallback	function that you want to be called on every value change after the initial read,
+	#						see add_callback()
+	def __init__(self, bus, serviceName, eventCallback=None):
+		self._bus = bus
+		self._serviceName = serviceName
+		self._values = {}
+		self._pathcallbacks = defaultdict(list)
+		self._prefixcallbacks = []
+		self._owner = None
+		self._loaded = False
+
+		self._root = bus.get_object(serviceName, '/', introspect=False)
+		self._match = self._root.connect_to_signal(
+			"ItemsChanged", weak_functor(self._items_changed_handler))
+		self._propertiesmatch = bus.add_signal_receiver(weak_functor(self._properties_changed_handler),
+			dbus_interface='com.victronenergy.BusItem', signal_name='PropertiesChanged',
+			bus_name=serviceName, path_keyword='path')
+		self._ownerwatch = bus.watch_name_owner(serviceName, weak_functor(self._name_owner_changed))
+		self.refresh()
+
+		if eventCallback is not None:
+			self.add_callback('/', eventCallback)
+
+	def __del__(self):
+		if self._match is not None:
+			self._match.remove()
+			self._match = None
+		if self._propertiesmatch is not None:
+			self._propertiesmatch.remove()
+			self._propertiesmatch = None
+		if self._ownerwatch is not None:
+			self._ownerwatch.cancel()
+			self._ownerwatch = None
+		self._root = None
+
+	## Returns the dbus service name as a string, for example com.victronenergy.vebus.ttyO1
+	@property
+	def serviceName(self):
+		return self._serviceName
+
+	## Calls callback(serviceName, path, changes) when a value changes
+	# @param path	a path, or a prefix ending with a '/' for all paths below it, '/' for all paths
+	def add_callback(self, path, callback):
+		if path.endswith('/'):
+			self._prefixcallbacks.append((path, callback))
+		else:
+			self._pathcallbacks[path].append(callback)
+
+	def remove_callback(self, path, callback):
+		if path.endswith('/'):
+			self._prefixcallbacks.remove((path, callback))
+		else:
+			self._pathcallbacks[path].remove(callback)
+			if not self._pathcallbacks[path]:
+				del self._pathcallbacks[path]
+
+	## Returns the unwrapped value of a path, None when it is invalid or does not exist
+	def get_value(self, path):
+		return self._values.get(path)
+
+	## Returns the text of a path, asked from the service
+	def get_text(self, path):
+		return self._bus.get_object(self._serviceName, path, introspect=False).GetText()
+
+	## Returns True when the service has the path, even if its value is invalid
+	def exists(self, path):
+		return path in self._values
+
+	## Returns the paths of the service, as read with GetItems and since added by ItemsChanged
+	def paths(self):
+		return self._values.keys()
+
+	## Reads all items again, calls the callbacks of the values that changed. Returns False when the
+	# service is not there or does not support GetItems.
+	def refresh(self):
+		try:
+			items = self._root.GetItems()
+		except dbus.exceptions.DBusException as e:
+			logging.debug("GetItems on %s failed: %s", self._serviceName, e)
+			self._invalidate()
+			return False
+
+		self._loaded = True
+		for path in [p for p in self._values if p not in items]:
+			self._set(path, None, None)
+			del self._values[path]
+		self._items_changed_handler(items)
+		return True
+
+	def _invalidate(self):
+		for path in self._values:
+			self._set(path, None, None)
+
+	def _name_owner_changed(self, owner):
+		# the first owner is reported from the mainloop, after the constructor already read the items
+		first, self._owner = self._owner is None, owner
+		if first and self._loaded:
+			return
+		if owner:
+			self.refresh()
+		else:
+			self._invalidate()
+
+	def _items_changed_handler(self, items):
+		if not isinstance(items, dict):
+			return
+
+		for path, changes in items.items():
+			try:
+				v = changes['Value']
+			except KeyError:
+				continue
+			self._set(path, unwrap_dbus_value(v), changes.get('Text'))
+
+	def _properties_changed_handler(self, changes, path=None):
+		if path is None or 'Value' not in changes:
+			return
+		self._set(path, unwrap_dbus_value(changes['Value']), changes.get('Text'))
+
+	def _set(self, path, value, text):
+		if path in self._values and self._values[path] == value:
+			return
+		self._values[path] = value
+
+		callbacks = self._pathcallbacks.get(path, [])
+		callbacks = callbacks + [c for prefix, c in self._prefixcallbacks if path.startswith(prefix)]
+		if not callbacks:
+			return
+		if text is None:
+			text = '---' if value is None else str(value)
+		changes = {'Value': value, 'Text': text}
+		for callback in callbacks:
+			# like VeDbusItemImport, an error in a callback must not end up in the dbus code
+			try:
+				callback(self._serviceName, path, changes)
+			except:
+				traceback.print_exc()
+				os._exit(1)  # sys.exit() is not used, since that also throws an exception
+
+
 class VeDbusTreeExport(dbus.service.Object):
 	def __init__(self, bus, objectPath, service):
 		dbus.service.Object.__init__(self, bus, objectPath)
@@ -412,13 +655,8 @@ class VeDbusTreeExport(dbus.service.Object):
 	def _get_value_handler(self, path, get_text=False):
 		logging.debug("_get_value_handler called for %s" % path)
 		r = {}
-		px = path
-		if not px.endswith('/'):
-			px += '/'
-		for p, item in self._service._dbusobjects.items():
-			if p.startswith(px):
-				v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
-				r[p[len(px):]] = v
+		for p, item in self._service._subtree(path.rstrip('/') or '/').items():
+			r[p] = item.GetText() if get_text else item.GetValue()
 		logging.debug(r)
 		return r
 
@@ -441,12 +679,7 @@ class VeDbusRootExport(VeDbusTreeExport):
 
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}')
 	def GetItems(self):
-		return {
-			path: {
-				'Value': wrap_dbus_value(item.local_get_value()),
-				'Text': item.GetText() }
-			for path, item in self._service._dbusobjects.items()
-		}
+		return self._service._get_items()
 
 
 class VeDbusItemExport(dbus.service.Object):
@@ -462,9 +695,13 @@ class VeDbusItemExport(dbus.service.Object):
 	# @param callback	  Function that will be called when someone else changes the value of this VeBusItem
 	#                     over the dbus. First parameter passed to callback will be our path, second the new
 	#					  value. This callback should return True to accept the change, False to reject it.
+	# @param changedcallback  Function that will be called with our path and the changes (wrapped value and text)
+	#					  each time the value changed, locally or over the dbus.
+	# @param textformat	  Format string for the text, e.g. '{:.2f}kWh', instead of a gettextcallback.
+	# @param lazytext	  When True, the changes only hold the Value. The text is formatted on GetText.
 	def __init__(self, bus, objectPath, value=None, description=None, writeable=False,
 					onchangecallback=None, gettextcallback=None, deletecallback=None,
-					valuetype=None):
+					valuetype=None, changedcallback=None, textformat=None, lazytext=False):
 		dbus.service.Object.__init__(self, bus, objectPath)
 		self._onchangecallback = onchangecallback
 		self._gettextcallback = gettextcallback
@@ -472,7 +709,17 @@ class VeDbusItemExport(dbus.service.Object):
 		self._description = description
 		self._writeable = writeable
 		self._deletecallback = deletecallback
+		self._changedcallback = changedcallback
 		self._type = valuetype
+		self._wrap = dbus_value_wrapper(valuetype)
+		self._format = textformat.format if textformat is not None else None
+		self._lazytext = lazytext
+		# recent texts by value. Only for a textformat, where the text depends on nothing but the value (a
+		# gettextcallback may also use a setting or another path), and only with a pinned valuetype, else 1, 1.0
+		# and True would share one entry.
+		self._textmemo = {} if textformat is not None and valuetype is not None else None
+		if valuetype is not None and value is not None and type(value) is not valuetype:
+			self._value = valuetype(value)
 
 	# To force immediate deregistering of this dbus object, explicitly call __del__().
 	def __del__(self):
@@ -501,14 +748,19 @@ class VeDbusItemExport(dbus.service.Object):
 			self.PropertiesChanged(changes)
 
 	def _local_set_value(self, newvalue):
+		if self._type is not None and newvalue is not None and type(newvalue) is not self._type:
+			newvalue = self._type(newvalue)
+
 		if self._value == newvalue:
 			return None
 
 		self._value = newvalue
-		return {
-			'Value': wrap_dbus_value(newvalue),
-			'Text': self.GetText()
-		}
+		changes = {'Value': VEDBUS_INVALID if newvalue is None else self._wrap(newvalue)}
+		if not self._lazytext:
+			changes['Text'] = self.GetText()
+		if self._changedcallback is not None:
+			self._changedcallback(self.__dbus_object_path__, changes)
+		return changes
 
 	def local_get_value(self):
 		return self._value
@@ -564,7 +816,7 @@ class VeDbusItemExport(dbus.service.Object):
 	# @return the value when valid, and otherwise an empty array
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='v')
 	def GetValue(self):
-		return wrap_dbus_value(self._value)
+		return VEDBUS_INVALID if self._value is None else self._wrap(self._value)
 
 	## Dbus exported method GetText
 	# Returns the value as string of the dbus-object-path.
@@ -574,6 +826,19 @@ class VeDbusItemExport(dbus.service.Object):
 		if self._value is None:
 			return '---'
 
+		if self._textmemo is None:
+			return self._get_text()
+		text = self._textmemo.get(self._value)
+		if text is None:
+			if len(self._textmemo) >= TEXT_MEMO_SIZE:
+				self._textmemo.clear()
+			text = self._textmemo[self._value] = self._get_text()
+		return text
+
+	def _get_text(self):
+		if self._format is not None:
+			return self._format(self._value)
+
 		# Default conversion from dbus.Byte will get you a character (so 'T' instead of '84'), so we
 		# have to convert to int first. Note that if a dbus.Byte turns up here, it must have come from
 		# the application itself, as all data from the D-Bus should have been unwrapped by now.
@@ -595,6 +860,9 @@ class VeDbusItemExport(dbus.service.Object):
 	def PropertiesChanged(self, changes):
 		pass
 
+# Number of texts remembered per item, e.g. all values of an UpdateIndex or a power that moves back and forth
+TEXT_MEMO_SIZE = 32
+
 ## This class behaves like a regular reference to a class method (eg. self.foo), but keeps a weak reference
 ## to the object which method is to be called.
 ## Use this object to break circular references.